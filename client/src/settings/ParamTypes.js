@@ -95,10 +95,11 @@ export default class ParamTypes {
         const getParamsFromField = (prefix, spec, data) => data[this.getParamFormId(prefix, spec.id)];
 
         const validateSelectEntity = (prefix, spec, state) => {
+                const card = parseCardinality(spec.cardinality);
                 const formId = this.getParamFormId(prefix, spec.id);
                 const sel = state.getIn([formId, 'value']);
 
-                if (sel === undefined || sel === null) {
+                if ((sel === undefined || sel === null) && card.min === 1) {
                     state.setIn([formId, 'error'], t('Exactly one item has to be selected'));
                 }
             };
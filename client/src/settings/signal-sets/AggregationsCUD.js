@@ -12,6 +12,7 @@ import {
     Button,
     ButtonRow,
     DateTimePicker,
+    Dropdown,
     filterData,
     Form,
     FormSendMethod,
@@ -30,6 +31,7 @@ import {getSignalTypes} from "../signal-sets/signals/signal-types.js";
 import moment from "moment";
 import interoperableErrors from "../../../../shared/interoperable-errors";
 import {isSignalSetAggregationIntervalValid} from "../../../../shared/validators"
+import {SignalSetPartitioning} from "../../../../shared/signal-sets";
 
 @withComponentMixins([
     withTranslation,
@@ -45,6 +47,13 @@ export default class CUD extends Component {
 
         this.state = {};
 
+        this.partitioningOptions = [
+            {key: '', label: t('None')},
+            {key: SignalSetPartitioning.YEAR, label: t('Yearly')},
+            {key: SignalSetPartitioning.MONTH, label: t('Monthly')},
+            {key: SignalSetPartitioning.DAY, label: t('Daily')}
+        ];
+
         this.initForm();
 
     }
@@ -63,7 +72,8 @@ export default class CUD extends Component {
             this.populateFormValues({
                 ts: props.job.params.ts,
                 interval: props.job.params.interval,
-                offset: props.job.params.offset || ''
+                offset: props.job.params.offset || '',
+                partitioning: props.job.params.partitioning || ''
             });
         } else {
             const ts = props.signalSet.settings && props.signalSet.settings.ts;
@@ -71,7 +81,8 @@ export default class CUD extends Component {
             this.populateFormValues({
                     ts: ts,
                     interval: '',
-                    offset: ''
+                    offset: '',
+                    partitioning: ''
                 }
             )
         }
@@ -114,11 +125,13 @@ export default class CUD extends Component {
 
         data.interval = data.interval.trim();
         data.offset = data.offset.trim() ? data.offset : null;
+        data.partitioning = data.partitioning || null;
 
         const allowedKeys = [
             'interval',
             'ts',
-            'offset'
+            'offset',
+            'partitioning'
         ];
 
         return filterData(data, allowedKeys);
@@ -248,6 +261,12 @@ export default class CUD extends Component {
                                 withHints={['30m', '1h', '12h', '1d', '30d']}
                                 disabled={isEdit}/>
 
+                    <Dropdown id="partitioning"
+                              label={t('Partitioning')}
+                              help={t('Store the aggregation in an index per time period, so that incremental updates and retention touch only the affected periods')}
+                              options={this.partitioningOptions}
+                              disabled={isEdit}/>
+
 
                     <ButtonRow>
                         {isEdit &&
@@ -1,3 +1,5 @@
+from ivis import ivis
+
 import sys
 import os
 import json
@@ -6,73 +8,211 @@ from datetime import datetime, timedelta
 import requests
 import subprocess
 import pathlib
-from elasticsearch import Elasticsearch, helpers
-    
-    
+import hashlib
+import pickle
+import fcntl
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from elasticsearch import helpers
+
+
 from eppy import modeleditor
 from eppy.modeleditor import IDF
 idd_file = "/usr/local/Energy+.idd"
 IDF.setiddname(idd_file)
 
 from io import StringIO
-    
-# Get parameters and set up elasticsearch
-data = json.loads(sys.stdin.readline())
-es = Elasticsearch([{'host': data['es']['host'], 'port': int(data['es']['port'])}], timeout=120)
 
-state = data.get('state')
-if state is None:
-  state= {}
+# Downloaded inputs and the parsed IDD are kept between runs in the task directory
+cache_dir = pathlib.Path('cache')
+cache_dir.mkdir(exist_ok=True)
+cache_meta_file = cache_dir / 'meta.json'
+cache_lock_file = cache_dir / 'meta.lock'
+
+def write_atomic(path, data):
+  """
+  All jobs of the task share the cache, the file is replaced at once so that others never read it half written.
+  """
+  tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+  tmp_path.write_bytes(data)
+  os.replace(tmp_path, path)
+
+def load_cache_meta():
+  try:
+    return json.loads(cache_meta_file.read_text())
+  except (OSError, ValueError):
+    # Missing or unreadable metadata, everything is downloaded again
+    return {}
+
+def store_cache_meta(name, entry):
+  """
+  Jobs running at the same time store their entries into the same metadata,
+  the current file is re-read under the lock so that entries stored by others in the meantime are kept.
+  """
+  cache_meta[name] = entry
+  with open(cache_lock_file, 'a') as lock:
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+      stored = load_cache_meta()
+      stored[name] = entry
+      write_atomic(cache_meta_file, json.dumps(stored).encode())
+    finally:
+      fcntl.flock(lock, fcntl.LOCK_UN)
+
+cache_meta = load_cache_meta()
+
+def file_hash(path):
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+# Parsing the IDD takes seconds, the pickled result of the parse loads in milliseconds
+idd_cache_file = cache_dir / f'idd-{file_hash(idd_file)}.pickle'
+idd_cached = False
+if idd_cache_file.exists():
+  try:
+    with open(idd_cache_file, 'rb') as f:
+      IDF.setidd(*pickle.load(f))
+    idd_cached = True
+  except Exception as e:
+    print(f'Cached IDD could not be loaded, parsing again: {e}')
+
+def store_idd_cache():
+  if not idd_cached and IDF.idd_info is not None:
+    for old in cache_dir.glob('idd-*.pickle'):
+      try:
+        old.unlink()
+      except FileNotFoundError:
+        # Removed by another job at the same time
+        pass
+    write_atomic(idd_cache_file, pickle.dumps((IDF.idd_info, IDF.idd_index, IDF.block, IDF.idd_version), pickle.HIGHEST_PROTOCOL))
+
+def fetch_cached(name, url):
+  """
+  Download url into the cache, asking the server to skip the transfer if the cached copy is current.
+  Returns the path to the cached file and whether its content changed since the last run.
+  """
+  path = cache_dir / name
+  meta = cache_meta.get(name, {}) if path.exists() else {}
+
+  headers = {}
+  if meta.get('etag'):
+    headers['If-None-Match'] = meta['etag']
+  if meta.get('lastModified'):
+    headers['If-Modified-Since'] = meta['lastModified']
+
+  result = requests.get(url, headers=headers, timeout=90)
+  if result.status_code == 304:
+    return path, False
+
+  if result.status_code != 200:
+    sys.stderr.write(f"File {name} couldn't be downloaded, code {result.status_code}")
+    exit(1)
+
+  digest = hashlib.sha256(result.content).hexdigest()
+  changed = digest != meta.get('sha256')
+  if changed:
+    write_atomic(path, result.content)
+
+  store_cache_meta(name, {
+    'etag': result.headers.get('ETag'),
+    'lastModified': result.headers.get('Last-Modified'),
+    'sha256': digest
+  })
+  return path, changed
 
-params= data['params']
-entities= data['entities']
+es = ivis.elasticsearch
+params= ivis.params
+entities= ivis.entities
+owned= ivis.owned
 
 # BODY ==================================================================
 api_url_base = 'https://deksoft.eu/api'
 api_url_login = f'{api_url_base}/login'
 api_url_file = f'{api_url_base}/meteo-file'
 
-occ = params['occ']
-mod = params['mod']
+# Scenarios to simulate, the single occ/mod pair is kept for jobs created before scenarios were supported
+pairs = [(scenario['occ'], scenario['mod']) for scenario in params.get('scenarios') or []]
+if params.get('occ') and params.get('mod'):
+  pairs.insert(0, (params['occ'], params['mod']))
+
+# Each scenario runs in its own directory, the same one given twice is simulated once
+scenarios = [{'occ': occ, 'mod': mod} for occ, mod in dict.fromkeys(pairs)]
+
+if not scenarios:
+  sys.stderr.write("No scenario to simulate")
+  exit(1)
 
 username = 'sieglp'
 password = 'jEkZTwB9l5oE033VoX2E'
- 
+
 current_date = datetime.now()
- 
+
 login_result = requests.post(api_url_login, data = {'username':username, 'password': password})
 acc_info = login_result.json()
 
 acc_key = acc_info['accessKey']
 key_param = f'access_key={acc_key}'
 
+# Weather is the same for all the scenarios, it is downloaded once
 url_epw = api_url_epw_file = f'{api_url_file}?{key_param}&action=epw'
-epw_result = requests.get(url_epw, timeout=90)
+epw_path, epw_changed = fetch_cached('weather.epw', url_epw)
 
+from_date = current_date - timedelta(days=3)
+to_date = current_date + timedelta(days=1)
 
-if epw_result.status_code != 200 :
-  sys.stderr.write(f"Weather file couldn't be downloaded, code {epw_result.status_code}")
-  exit(1)
-
-model_dir = f'occ{occ}_mod{mod}'
-os.makedirs(f'{model_dir}', exist_ok=True)
-with open(f'{model_dir}/weather.epw', 'wb') as f:
-  f.write(epw_result.content)
+print(current_date)
 
-if state is None or state.get('index') is None:
+for scenario in scenarios:
+  occ = scenario['occ']
+  mod = scenario['mod']
+  url = f'{api_url_file}?{key_param}&action=idf&occ={occ}&mod={mod}'
+  scenario['idf_path'], scenario['idf_changed'] = fetch_cached(f'occ{occ}_mod{mod}.idf', url)
+  # Jobs of the task share its directory, each runs its simulations in a directory of its own
+  scenario['model_dir'] = f'job{ivis._jobId}/occ{occ}_mod{mod}'
+  scenario['cid'] = f"energy_plus_{mod}_{occ}"
+
+if not idd_cached:
+  # IDD is parsed once here, the simulations share it
+  IDF(StringIO(''))
+  store_idd_cache()
+
+def simulate(scenario, input_key, prepared_key):
+  """
+  Runs in a thread of the pool. Prepares the input of the scenario in its own directory and runs EnergyPlus there.
+  """
+  model_dir = scenario['model_dir']
+  os.makedirs(f'{model_dir}', exist_ok=True)
+  if epw_changed or not pathlib.Path(f'{model_dir}/weather.epw').exists():
+    with open(f'{model_dir}/weather.epw', 'wb') as f:
+      f.write(epw_path.read_bytes())
+
+  # The prepared input depends only on the downloaded model and the simulated period,
+  # if neither changed since the last run, the model is not parsed and edited again
+  input_ready = not scenario['idf_changed'] and prepared_key == input_key and pathlib.Path(f'{model_dir}/input.idf').exists()
+
+  if not input_ready:
+    # Edit idf file date
+    idf = IDF(StringIO(scenario['idf_path'].read_text()))
+    period =  idf.idfobjects["RunPeriod"][0]
+
+    period.Begin_Day_of_Month =   from_date.day
+    period.Begin_Month =   from_date.month
+    period.Begin_Year =   from_date.year
+
+    period.End_Day_of_Month =  to_date.day
+    period.End_Month =  to_date.month
+    period.End_Year = to_date.year
+
+    # Save to file
+    idf.saveas(f'{model_dir}/input.idf')
+
+  subprocess.run(['/usr/local/energyplus', '-w', r'weather.epw', 'input.idf'], cwd=f'{model_dir}', check=True)
+
+def create_signal_set(cid, occ, mod):
   ns = 1
 
-  msg = {}
-  msg['type'] = 'sets'
-  # Request new signal set creation 
-  msg['sigSet'] = {
-  "cid" : f"energy_plus_{mod}_{occ}",
-  "name" : f"EnergyPlus mod{mod} occ{occ}" ,
-  "namespace": ns,
-  "description" : f"EnergyPlus calculation for mod {mod} and occ {occ}" ,
-  "aggs" :  "0" 
-  }
-
   signals= []
   signals.append({
     "cid": "date",
@@ -110,159 +250,129 @@ if state is None or state.get('index') is None:
     "indexed": False,
     "settings": {}
   })
-  msg['sigSet']['signals'] = signals
-
-  ret = os.write(3,(json.dumps(msg) + '\n').encode())
-  state = json.loads(sys.stdin.readline())
-  
-  error = state.get('error')
-  if error:
-    sys.stderr.write(error+"\n")
-    sys.exit(1)
-else: 
-  #clean up before calculation
-  es.delete_by_query(index=state['index'],request_timeout=60,body={"query" :{
-    "match_all": {}
-# Possible incremental delete
-#    "range" : {
-#      state['fields']['date']: {
-#        "gte": current_date.date()
-#      }
-#    }
-  }})
-
-url = f'{api_url_file}?{key_param}&action=idf&occ={occ}&mod={mod}'
-idf_result = requests.get(url, timeout=90)
-
-if idf_result.status_code != 200 :
-  sys.stderr.write(f"IDF file couldn't be downloaded, code {idf_result.status_code}")
-  exit(1)
-
-# Edit idf file date
-idf = IDF(StringIO(idf_result.text))
-period =  idf.idfobjects["RunPeriod"][0]
 
-from_date = current_date - timedelta(days=3)
-period.Begin_Day_of_Month =   from_date.day
-period.Begin_Month =   from_date.month
-period.Begin_Year =   from_date.year
-
-print(current_date)
-
-# for debug
-#period.Begin_Day_of_Month =   7
-#period.Begin_Month =   10
-#period.Begin_Year =   2019
-
-#last =  state.get('last_run') or {}
-# Part of incremental update
-#period.Begin_Day_of_Month = last.get('day') or 1
-#period.Begin_Month = last.get('month') or 1
-#period.Begin_Year = last.get('year') or current_date.year
-
-# last run will be used in possible incremental implementation, next start will be -1 day?
-#state['last_run']= {}
-#to_date = current_date + timedelta(days=1)
-#tate['last_run']['day'] = period.End_Day_of_Month =  to_date.day
-#state['last_run']['month'] = period.End_Month =  to_date.month
-#state['last_run']['year'] = period.End_Year = to_date.year
-
-to_date = current_date + timedelta(days=1)
-period.End_Day_of_Month =  to_date.day
-period.End_Month =  to_date.month
-period.End_Year = to_date.year
-
-#for debug
-#period.End_Day_of_Month = 11
-#period.End_Month =  10
-#period.End_Year = 2019
-
-# Save to file
-idf.saveas(f'{model_dir}/input.idf')
-subprocess.run(['/usr/local/energyplus', '-w', r'weather.epw', 'input.idf'],cwd=f'{model_dir}')
+  ivis.create_signal_set(cid, ns, f"EnergyPlus mod{mod} occ{occ}", f"EnergyPlus calculation for mod {mod} and occ {occ}", None, signals)
 
 # Generator for computed values
-def iterResults():
+def iterResults(model_dir, index, fields):
   if not pathlib.Path(f'{model_dir}/eplusout.eso').exists():
-    sys.stderr.write(f"File eplusout.eso not found.")
-    exit(1)
-    
+    raise Exception(f"File eplusout.eso not found.")
+
   with open(f'{model_dir}/eplusout.eso', 'r') as f:
     # Skip dictionary segment
     while True:
       line = f.readline()
       if not line:
-        sys.stderr.write(f"File eplusout.eso is not in corrrect format.")
-        exit(1)
+        raise Exception(f"File eplusout.eso is not in corrrect format.")
       else:
         line=line.strip()
-      
+
       if line=='End of Data Dictionary':
         break;
-        
+
     # Get values
     doc_source=None
     date=None
     time_zone = 0
     while True:
       line = f.readline()
-      
+
       if not line:
         break
-      
+
       line=line.strip()
       if line=='End of Data':
         break;
-      
+
       line_data = line.split(',')
       if line_data[0]=='1':
         time_zone = float(line_data[4].strip())
-        
+
       elif line_data[0]=='2':
          # new data block
 
         if doc_source is not None:
           yield {
-            "_index": state['index'],
+            "_index": index,
             "_type": '_doc',
             "_id":  date,
             "_source": doc_source
           }
 
-          
+
         ## VALUES IN ORDER
         #Day of Simulation[]
         month= '{:02d}'.format(int(line_data[2]))#Month[]
         day = '{:02d}'.format(int(line_data[3])) #Day of Month[]
         tz_dst = time_zone + int(line_data[4]) #DST Indicator[1=yes 0=no]
-        hour='{:02d}'.format(int(line_data[5])-1)#Hour[]  #-1 is here because for some reason (DST?) hours start on 1 not 0 
+        hour='{:02d}'.format(int(line_data[5])-1)#Hour[]  #-1 is here because for some reason (DST?) hours start on 1 not 0
         start_min=line_data[6]#StartMinute[]
         end_min=line_data[7]#EndMinute[]
         #DayType
-        
+
         #custom values
         min = '{:02d}'.format(int((float(start_min) + float(end_min)) / 2)) # TODO separate seconds
         # FIXME this should take the value somewhere from input, don't know where currently
         year = current_date.year
-        
+
         sign = "+" if tz_dst >= 0 else "-"
         tz = '{:02d}'.format(int(tz_dst))
         date=f'{year}-{month}-{day}T{hour}:{min}:00.000{sign}{tz}:00'
         doc_source = {
-          state['fields']['date']: date
+          fields['date']: date
         }
-         
+
       elif line_data[0]=='118': #Temperature
-        doc_source[state['fields']['temperature']]= line_data[1]
+        doc_source[fields['temperature']]= line_data[1]
       elif line_data[0]=='205': #Humidity
-        doc_source[state['fields']['humidity']]= line_data[1]
+        doc_source[fields['humidity']]= line_data[1]
       elif line_data[0]=='206': #CO2
-        doc_source[state['fields']['co2']]= line_data[1]
+        doc_source[fields['co2']]= line_data[1]
 
-helpers.bulk(es, iterResults())
+def store_results(scenario):
+  cid = scenario['cid']
+  index = entities['signalSets'][cid]['index']
+  fields = {sig_cid: signal['field'] for sig_cid, signal in entities['signals'][cid].items()}
 
-msg = {}
-msg["type"] = "store"
-msg["state"] = state
-ret = os.write(3,(json.dumps(msg).encode()))
-os.close(3)
+  #clean up before storing new results
+  es.delete_by_query(index=index, request_timeout=60, body={"query" :{
+    "match_all": {}
+  }})
+  helpers.bulk(es, iterResults(scenario['model_dir'], index, fields))
+
+for scenario in scenarios:
+  if owned['signalSets'].get(scenario['cid']) is None:
+    create_signal_set(scenario['cid'], scenario['occ'], scenario['mod'])
+
+# One simulation per available core, each runs in the directory of its scenario
+try:
+  workers = len(os.sched_getaffinity(0))
+except AttributeError:
+  workers = os.cpu_count() or 1
+workers = min(workers, len(scenarios))
+
+failed = 0
+# Threads are enough as the simulation itself runs in an EnergyPlus process,
+# forked processes would block on stdin held by the ivis reader thread
+with ThreadPoolExecutor(max_workers=workers) as pool:
+  futures = {}
+  for scenario in scenarios:
+    input_key = f"{cache_meta[scenario['idf_path'].name]['sha256']}:{from_date.date()}:{to_date.date()}"
+    prepared_key = cache_meta.get(f"{scenario['model_dir']}/input.idf")
+    futures[pool.submit(simulate, scenario, input_key, prepared_key)] = (scenario, input_key)
+
+  # Results are stored as soon as their simulation finishes, while the others still run
+  for done, future in enumerate(as_completed(futures), 1):
+    scenario, input_key = futures[future]
+    try:
+      future.result()
+      store_cache_meta(f"{scenario['model_dir']}/input.idf", input_key)
+      store_results(scenario)
+    except Exception as e:
+      failed += 1
+      sys.stderr.write(f"Scenario occ {scenario['occ']} mod {scenario['mod']} failed: {e}\n")
+
+    ivis.report_progress(done, len(scenarios), force=True)
+
+if failed:
+  sys.exit(1)
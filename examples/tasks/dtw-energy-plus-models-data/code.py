@@ -1,20 +1,13 @@
-import sys
-import os
-import json
-from elasticsearch import Elasticsearch, helpers
+from ivis import ivis
 
 from datetime import datetime, timezone
+import time
 import numpy as np
-from dtw import dtw
 
-# Get parameters and set up elasticsearch
-data = json.loads(sys.stdin.readline())
-es = Elasticsearch([{'host': data['es']['host'], 'port': int(data['es']['port'])}])
-
-state = data.get('state')
-
-params= data['params']
-entities= data['entities']
+es = ivis.elasticsearch
+state = ivis.state
+params= ivis.params
+entities= ivis.entities
 
 # Get ES index and fields
 sensor_set = entities['signalSets'][params['sensors']]
@@ -25,21 +18,15 @@ limit_val = float(params['limitValue'])
 
 limit = limit_val
 
-if state is None or state.get('index') is None:
+# Number of samples (minutes) the comparison looks back at
+window = 180
+# Older costs fade out with this factor per alignment step, so the distance reflects roughly the last window
+decay = 1 - 1 / window
+
+if state is None or state.get('e_plus_mod') is None:
     ns = sensor_set['namespace']
-  
-    msg = {}
-    msg['type'] = 'sets'
-    # Request new signal set creation 
-    msg['sigSet'] = {
-    "cid" : "e_plus_mod",
-    "name" : "E+ comparison" ,
-    "namespace": ns,
-    "description" : "Comparison of Energy+ models" ,
-    "aggs" :  "0" 
-    }
 
-    signals= [] 
+    signals= []
     signals.append({
       "cid": "ts",
       "name": "ts",
@@ -67,75 +54,127 @@ if state is None or state.get('index') is None:
       "indexed": False,
       "settings": {}
     })
-    msg['sigSet']['signals'] = signals
-
-    ret = os.write(3,(json.dumps(msg) + '\n').encode())
-    state = json.loads(sys.stdin.readline())
-    error = state.get('error')
-    if error:
-      sys.stderr.write(error+"\n")
-      sys.exit(1)
-    else:
-      store_msg = {}
-      store_msg["type"] = "store"
-      store_msg["state"] = state
-      ret = os.write(3,(json.dumps(store_msg) + '\n').encode())
-
-def get_co2_values(index,ts_field, co2_field):
-  # sensor data query
+
+    state = ivis.create_signal_set("e_plus_mod", ns, "E+ comparison", "Comparison of Energy+ models", None, signals)
+    ivis.store_state(state)
+
+out_set = state['e_plus_mod']
+out_fields = {cid: signal['field'] for cid, signal in out_set['signals'].items()}
+
+def get_co2_values(index,ts_field, co2_field, since=None):
+  # sensor data query, only samples newer than since are fetched when given
   query = {
+      'size': 10000,
       '_source': [co2_field, ts_field],
       'sort': [{ts_field: 'asc'}],
       'query': {
         "range" : {
           ts_field : {
-            "gt" : "now-180m/m",
+            "gt" : since if since is not None else f"now-{window}m/m",
             "lt" : "now/m"
           }
         }
       }
   }
-  
+
   results = es.search(index=index, body=query)
-  
-  sensor_data = []
+
+  timestamps = []
+  values = []
   for item in results['hits']['hits']:
-    val = item["_source"][co2_field]
+    val = item["_source"].get(co2_field)
     if val is not None:
-      sensor_data.append(val)
-    else:
-      continue
-  
-  return sensor_data
-
-sensor_data = get_co2_values(sensor_set['index'], sensor_ts['field'], sensor_co2['field'])
-
-if not sensor_data:
-  print('No sensor data to measure on')
-  exit()
-
-sensor_np = np.array(sensor_data, dtype=float).reshape(-1, 1)
+      timestamps.append(item["_source"][ts_field])
+      values.append(val)
+
+  return timestamps, np.array(values, dtype=float)
+
+def to_state_list(arr):
+  # Infinity is not valid JSON, cells outside of the band are stored as None
+  return [None if np.isinf(val) else float(val) for val in arr]
+
+def from_state_list(lst):
+  return np.nan_to_num(np.array(lst, dtype=float), nan=np.inf)
+
+def extend_dtw(dtw_state, new_x, new_y):
+  """
+  Extends the accumulated cost matrix of an online DTW by newly arrived samples of both series.
+  Only the last row and column of the matrix and the last `window` samples of both series are kept,
+  so the cost of a run depends on the amount of new data and the window, not on the length of the history.
+  """
+  fresh = dtw_state is None
+  if fresh:
+    old_x = np.empty(0)
+    old_y = np.empty(0)
+  else:
+    old_x = from_state_list(dtw_state['x'])
+    old_y = from_state_list(dtw_state['y'])
+
+  p = len(old_x)
+  q = len(old_y)
+  x = np.concatenate((old_x, new_x))
+  y = np.concatenate((old_y, new_y))
+
+  cost = np.abs(x[:, None] - y[None, :])
+  acc = np.full(cost.shape, np.inf)
+  if not fresh:
+    acc[p - 1, :q] = from_state_list(dtw_state['row'])
+    acc[:p, q - 1] = from_state_list(dtw_state['col'])
+
+  for i in range(len(x)):
+    # Old rows only get the new columns, new rows are computed completely
+    for j in range(q if i < p else 0, len(y)):
+      if fresh and i == 0 and j == 0:
+        acc[i, j] = cost[i, j]
+        continue
+
+      best = min(
+        acc[i - 1, j - 1] if i > 0 and j > 0 else np.inf,
+        acc[i - 1, j] if i > 0 else np.inf,
+        acc[i, j - 1] if j > 0 else np.inf
+      )
+      acc[i, j] = cost[i, j] + decay * best
+
+  return {
+    'x': to_state_list(x[-window:]),
+    'y': to_state_list(y[-window:]),
+    'row': to_state_list(acc[-1, -window:]),
+    'col': to_state_list(acc[-window:, -1]),
+    # Normalized so that the distance is comparable to a mean difference of the samples
+    'distance': float(acc[-1, -1] * (1 - decay))
+  }
 
-euclidean_norm = lambda x, y: np.abs(x - y)
+dtw_states = state.setdefault('dtw', {})
 
 min_model={}
 min_distance=float("inf")
 for model in params['models']:
-  
+
   ts =entities['signals'][model['sigSet']][model['ts']]['field']
   co2 =entities['signals'][model['sigSet']][model['co2']]['field']
   sig_set = entities['signalSets'][model['sigSet']]['index']
-  
-  model_data = get_co2_values(sig_set, ts,co2)
-  if not model_data:
+
+  # Alignment state is kept per model as the sensor data of each model is consumed independently
+  dtw_state = dtw_states.get(model['sigSet'])
+  if dtw_state is not None and time.time() - dtw_state['updated'] > window * 60:
+    # Alignment is too old to be extended, start over on the current window
+    dtw_state = None
+
+  sensor_times, sensor_np = get_co2_values(sensor_set['index'], sensor_ts['field'], sensor_co2['field'], dtw_state and dtw_state['sensorLast'])
+  model_times, model_np = get_co2_values(sig_set, ts, co2, dtw_state and dtw_state['modelLast'])
+
+  if dtw_state is None and (not sensor_times or not model_times):
     print(f'No data for signal set {sig_set}')
     continue
-  # Calculate for all models
-  model_np = np.array(model_data, dtype=float).reshape(-1, 1)
-  
-  # Calculate for all models
-  d, cost_matrix, acc_cost_matrix, path = dtw(sensor_np, model_np, dist=euclidean_norm)
-  
+
+  if sensor_times or model_times:
+    new_state = extend_dtw(dtw_state, sensor_np, model_np)
+    new_state['sensorLast'] = sensor_times[-1] if sensor_times else dtw_state['sensorLast']
+    new_state['modelLast'] = model_times[-1] if model_times else dtw_state['modelLast']
+    new_state['updated'] = time.time()
+    dtw_states[model['sigSet']] = dtw_state = new_state
+
+  d = dtw_state['distance']
   if d<min_distance:
     min_distance = d
     min_model['name'] = entities["signalSets"][model["sigSet"]]["name"]
@@ -144,16 +183,29 @@ for model in params['models']:
     min_model['co2'] = co2
     min_model['index'] = sig_set
 
+ivis.store_state(state)
+
 # Do something with closest model
 if not min_model:
   print('No model found')
   exit()
 print(f'Closest model is: {min_model["name"]}')
 
+# Last sensor value
+query = {
+   'size': 1,
+   '_source': [sensor_co2['field']],
+   'sort': [{sensor_ts['field']: 'desc'}],
+   'query': {
+      "match_all": {}
+   }
+}
+results = es.search(index=sensor_set['index'], body=query)
+last_sensor_value = results['hits']['hits'][0]['_source'][sensor_co2['field']]
+
 # Query prediction
 query = {
-    '_source': [min_model['co2'], min_model['ts']],
-    'sort': [{min_model['ts']: 'asc'}],
+    'size': 0,
     "aggs" : {
         "max_co2" : { "max" : { "field" : min_model['co2'] } }
     },
@@ -167,44 +219,34 @@ query = {
     }
 }
 
-
 results = es.search(index=min_model['index'], body=query)
 max_co2 = results['aggregations']['max_co2']['value']
 
-# Get current mode 
+# Get current mode
 # TODO this will probably change later on to take data from the actual system
 query = {
    'size': 1,
-   '_source': [state['fields']['mod']],
-   'sort': [{state['fields']['ts']: 'desc'}],
+   '_source': [out_fields['mod']],
+   'sort': [{out_fields['ts']: 'desc'}],
    'query': {
       "match_all": {}
    }
 }
-results = es.search(index=state['index'], body=query)
-mod = results['hits']['hits'][0]['_source'][state['fields']['mod']] if results['hits']['total'] > 0 else 'mod1'
+results = es.search(index=out_set['index'], body=query)
+mod = results['hits']['hits'][0]['_source'][out_fields['mod']] if results['hits']['hits'] else 'mod1'
 
 # If currently over limit or going to be according to models data, open more
-if sensor_data[-1] > limit or max_co2 > limit:
+if last_sensor_value > limit or (max_co2 is not None and max_co2 > limit):
   mod = 'mod2'
-elif sensor_data[-1] < limit - 200:
+elif last_sensor_value < limit - 200:
   mod = 'mod1'
 
 print(f'Chosen: {mod}')
 
 ts = datetime.now(timezone.utc).astimezone()
 doc = {
-  state['fields']['ts']: ts,
-  state['fields']['model']: min_model['cid'],
-  state['fields']['mod']: mod 
+  out_fields['ts']: ts,
+  out_fields['model']: min_model['cid'],
+  out_fields['mod']: mod
 }
-res = es.index(index=state['index'], doc_type='_doc', id=ts, body=doc)
-
-#prediction_data = []
-#for item in results['hits']['hits']:
-#  val = item["_source"][min_model['co2']]
-#  if val is not None:
-#    prediction_data.append(val)
-#  else:
-#    continue
-#print (prediction_data)
+res = es.index(index=out_set['index'], doc_type='_doc', id=ts, body=doc)
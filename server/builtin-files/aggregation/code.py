@@ -1,4 +1,5 @@
 from ivis import ivis
+from elasticsearch import helpers
 
 es = ivis.elasticsearch
 state = ivis.state
@@ -6,17 +7,52 @@ params= ivis.params
 entities= ivis.entities
 owned= ivis.owned
 
-sig_set_cid = params['signalSet']
-sig_set = entities['signalSets'][sig_set_cid]
-ts = entities['signals'][sig_set_cid][params['ts']]
 interval = params['interval']
-offset = params['offset']
+offset = params.get('offset')
+partitioning = params.get('partitioning') or None
+
+# Signal sets whose histograms are requested in one msearch
+batch_size = 50
+# Aggregated documents of all signal sets written in one bulk request
+bulk_size = 5000
+
+# Signal sets to aggregate with the cid of their timestamp signal
+sources = {}
+for entry in [params] + (params.get('sets') or []):
+  if not entry.get('signalSet'):
+    continue
+  if not entry.get('ts'):
+    print(f"Timestamp signal of signal set '{entry['signalSet']}' not specified, skipped")
+    continue
+  sources[entry['signalSet']] = entry['ts']
+if params.get('namespace') is not None:
+  for cid, sig_set in ivis.get_signal_sets_in_namespace(params['namespace'], include_signals=True).items():
+    # Computed signal sets, aggregations among them, are not aggregated further
+    if sig_set['type'] != 'computed' and params['tsSignal'] in entities['signals'][cid]:
+      sources.setdefault(cid, params['tsSignal'])
+
+if state is None:
+  state = {}
+
+# Watermarks of all the signal sets are kept in one state
+set_states = state.setdefault('sets', {})
+if 'last' in state:
+  # State of a job aggregating a single signal set stored before more sets were supported
+  single_state = {'last': state.pop('last'), 'lastKey': state.pop('lastKey', None)}
+  if params.get('signalSet'):
+    set_states.setdefault(params['signalSet'], single_state)
+
+
+def get_agg_set_cid(sig_set_cid):
+  return f"aggregation_{interval}_{sig_set_cid}"
+
 
-agg_set_cid =  f"aggregation_{interval}_{sig_set_cid}"
+def get_numeric_signals(sig_set_cid):
+  return { cid: signal for (cid,signal) in entities['signals'][sig_set_cid].items() if (signal['type'] in ['integer','long','float','double']) }
 
-numeric_signals = { cid: signal for (cid,signal) in entities['signals'][sig_set_cid].items() if (signal['type'] in ['integer','long','float','double']) }
 
-if owned['signalSets'].get(agg_set_cid) is None:
+def create_agg_set(sig_set_cid, ts, numeric_signals):
+  sig_set = entities['signalSets'][sig_set_cid]
   ns = sig_set['namespace']
 
   signals= []
@@ -52,40 +88,28 @@ if owned['signalSets'].get(agg_set_cid) is None:
       "settings": ts['settings']
   })
 
+  agg_set_cid = get_agg_set_cid(sig_set_cid)
   ivis.create_signal_set(
     agg_set_cid,
     ns,
     agg_set_cid,
     f"aggregation with interval '{interval}' for signal set '{sig_set_cid}'",
     None,
-    signals)
+    signals,
+    {'partitioning': partitioning} if partitioning is not None else None)
 
-  state = {}
-  state['last'] = None
-  ivis.store_state(state)
-
-if state is not None and state.get('last') is not None:
-  last = state['last']
-  filter = {
-    "range": {
-      ts['field']: {
-        "gte" : last
-      }
-    }
-  }
 
-  # Last calculated aggregation has to be redone, because new data points may have been added to it
-  es.delete_by_query(index=entities['signalSets'][agg_set_cid]['index'], body={
-    "query": {
-      "match": {
-        entities['signals'][agg_set_cid]['ts']['field']: last
+def get_query(ts, numeric_signals, last):
+  if last is not None:
+    # Last calculated aggregation is redone, because new data points may have been added to it
+    filter = {
+      "range": {
+        ts['field']: {
+          "gte" : last
+        }
       }
     }
-  })
-
-else:
-  state = {}
-  if offset is not None:
+  elif offset is not None:
     filter = {
       "range": {
         ts['field']: {
@@ -97,50 +121,111 @@ else:
   else:
     filter = {'match_all': {}}
 
-query_content = {
-  "bool": {
-    "filter": filter
-  }
-}
-
-stat_aggs = {}
-for cid, signal in numeric_signals.items():
-  stat_aggs[cid] = {
-    "stats": {
-      "field": signal['field']
+  stat_aggs = {}
+  for cid, signal in numeric_signals.items():
+    stat_aggs[cid] = {
+      "stats": {
+        "field": signal['field']
+      }
     }
-  }
 
-# interval is deprecated in the newer elasticsearch, instead fixed_interval should be used
-query = {
-  'size': 0,
-  'query': query_content,
-  "aggs": {
-    "sig_set_aggs": {
-      "date_histogram": {
-        "field": ts['field'],
-        "interval": interval
-      },
-      "aggs": stat_aggs
+  # interval is deprecated in the newer elasticsearch, instead fixed_interval should be used
+  return {
+    'size': 0,
+    'query': {
+      "bool": {
+        "filter": filter
+      }
+    },
+    "aggs": {
+      "sig_set_aggs": {
+        "date_histogram": {
+          "field": ts['field'],
+          "interval": interval
+        },
+        "aggs": stat_aggs
+      }
     }
   }
-}
 
-res = es.search(index=sig_set['index'], body=query)
 
-for hit in res['aggregations']['sig_set_aggs']['buckets']:
-  last = hit['key_as_string']
-  doc = {}
-  for cid in numeric_signals.keys():
-    doc[entities['signals'][agg_set_cid][f"_{cid}_min"]['field']]= hit[cid]['min']
-    doc[entities['signals'][agg_set_cid][cid]['field']]= hit[cid]['avg']
-    doc[entities['signals'][agg_set_cid][f"_{cid}_max"]['field']]= hit[cid]['max']
-    doc[entities['signals'][agg_set_cid][f"_{cid}_count"]['field']]= hit[cid]['count']
-    doc[entities['signals'][agg_set_cid][f"_{cid}_sum"]['field']]= hit[cid]['sum']
+class BulkWriter:
+  """Collects aggregated documents of all signal sets and writes them in large bulk requests."""
+
+  def __init__(self):
+    self.actions = []
+
+  def add(self, index, id, doc):
+    self.actions.append({
+      "_index": index,
+      "_type": '_doc',
+      "_id": id,
+      "_source": doc
+    })
+    if len(self.actions) >= bulk_size:
+      self.flush()
+
+  def flush(self):
+    if self.actions:
+      helpers.bulk(es, self.actions)
+      self.actions = []
+
+
+def add_aggregations(writer, sig_set_cid, ts, numeric_signals, res):
+  agg_set_cid = get_agg_set_cid(sig_set_cid)
+  agg_signals = entities['signals'][agg_set_cid]
+  set_state = set_states.setdefault(sig_set_cid, {})
+
+  for hit in res['aggregations']['sig_set_aggs']['buckets']:
+    last = hit['key_as_string']
+    doc = {}
+    for cid in numeric_signals.keys():
+      doc[agg_signals[f"_{cid}_min"]['field']]= hit[cid]['min']
+      doc[agg_signals[cid]['field']]= hit[cid]['avg']
+      doc[agg_signals[f"_{cid}_max"]['field']]= hit[cid]['max']
+      doc[agg_signals[f"_{cid}_count"]['field']]= hit[cid]['count']
+      doc[agg_signals[f"_{cid}_sum"]['field']]= hit[cid]['sum']
+
+    doc[agg_signals[ts['cid']]['field']] = last
+    # Bucket key is the id, so the redone last bucket replaces its previous version
+    writer.add(ivis.get_partition_index(agg_set_cid, hit['key']), last, doc)
+
+    set_state['last'] = last
+    set_state['lastKey'] = hit['key']
+
+
+queries = {}
+for sig_set_cid, ts_cid in sources.items():
+  ts = entities['signals'][sig_set_cid][ts_cid]
+  numeric_signals = get_numeric_signals(sig_set_cid)
+
+  if owned['signalSets'].get(get_agg_set_cid(sig_set_cid)) is None:
+    create_agg_set(sig_set_cid, ts, numeric_signals)
+    set_states[sig_set_cid] = {'last': None}
+
+  queries[sig_set_cid] = get_query(ts, numeric_signals, set_states.get(sig_set_cid, {}).get('last'))
+
+writer = BulkWriter()
+sig_set_cids = list(queries)
+for start in range(0, len(sig_set_cids), batch_size):
+  batch = sig_set_cids[start:start + batch_size]
+
+  body = []
+  for sig_set_cid in batch:
+    body.append({'index': entities['signalSets'][sig_set_cid]['index']})
+    body.append(queries[sig_set_cid])
+
+  responses = es.msearch(body=body)['responses']
+  for sig_set_cid, res in zip(batch, responses):
+    if 'error' in res:
+      print(f"Aggregation of signal set '{sig_set_cid}' failed: {res['error']}")
+      continue
 
-  doc[entities['signals'][agg_set_cid][ts['cid']]['field']] = last
-  res = es.index(index=entities['signalSets'][agg_set_cid]['index'], id=last, doc_type='_doc', body=doc)
+    ts = entities['signals'][sig_set_cid][sources[sig_set_cid]]
+    add_aggregations(writer, sig_set_cid, ts, get_numeric_signals(sig_set_cid), res)
 
+  ivis.report_progress(start + len(batch), len(sig_set_cids))
+  ivis.check_cancelled()
 
-state['last'] = last
-ivis.store_state(state)
\ No newline at end of file
+writer.flush()
+ivis.store_state(state)
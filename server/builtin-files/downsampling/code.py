@@ -0,0 +1,276 @@
+from ivis import ivis
+from elasticsearch import helpers
+import numpy as np
+import re
+
+es = ivis.elasticsearch
+state = ivis.state
+params= ivis.params
+entities= ivis.entities
+owned= ivis.owned
+
+sig_set_cid = params['signalSet']
+sig_set = entities['signalSets'][sig_set_cid]
+ts = entities['signals'][sig_set_cid][params['ts']]
+method = params['method']
+# Raw records processed at once
+chunk_size = 100000
+
+LTTB = 'lttb'
+MINMAX = 'minmax'
+
+UNITS = {'ms': 1, 's': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000, 'w': 7 * 24 * 60 * 60 * 1000}
+
+numeric_signals = { cid: signal for (cid,signal) in entities['signals'][sig_set_cid].items() if (signal['type'] in ['integer','long','float','double']) }
+
+
+def parse_resolution(resolution):
+  """Bucket width in milliseconds of a resolution like 30s, 15m or 1d."""
+  match = re.fullmatch(r'(\d+)(ms|s|m|h|d|w)', resolution)
+  if match is None:
+    raise ValueError(f"Resolution '{resolution}' not valid, expected a number followed by one of {', '.join(UNITS)}")
+  return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def bucket_bounds(bucket_ids):
+  """Start and end positions of the runs of equal ids in sorted bucket_ids."""
+  if len(bucket_ids) == 0:
+    return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+  starts = np.flatnonzero(np.r_[True, bucket_ids[1:] != bucket_ids[:-1]])
+  ends = np.r_[starts[1:], len(bucket_ids)]
+  return starts, ends
+
+
+def select_minmax(values, bucket_ids):
+  """Positions of the minimum and the maximum in each bucket, in time order."""
+  starts, ends = bucket_bounds(bucket_ids)
+  # Sorted by value within the buckets, the buckets stay in place
+  order = np.lexsort((values, bucket_ids))
+  return np.unique(np.concatenate((order[starts], order[ends - 1])))
+
+
+def select_lttb(times, values, bucket_ids, anchor, end_id):
+  """
+  Largest-triangle-three-buckets, selects the point of each bucket with id below end_id which forms the largest
+  triangle with the point selected in the previous bucket (anchor) and the average of the next bucket.
+  Bucket statistics are computed for all buckets at once, only the dependency on the previous selection is sequential.
+  """
+  starts, ends = bucket_bounds(bucket_ids)
+  ids = bucket_ids[starts]
+  counts = ends - starts
+  avg_times = np.add.reduceat(times, starts) / counts
+  avg_values = np.add.reduceat(values, starts) / counts
+
+  selected = []
+  for b in np.flatnonzero(ids < end_id):
+    start, end = starts[b], ends[b]
+    if anchor is None:
+      # Series starts with its first point
+      idx = start
+    else:
+      if b + 1 < len(ids) and ids[b + 1] == ids[b] + 1:
+        next_time, next_value = avg_times[b + 1], avg_values[b + 1]
+      else:
+        # A gap or the end of the data follows, the bucket is connected to it by its last point
+        next_time, next_value = times[end - 1], values[end - 1]
+
+      anchor_time, anchor_value = anchor
+      area = np.abs((anchor_time - next_time) * (values[start:end] - anchor_value) -
+                    (anchor_time - times[start:end]) * (next_value - anchor_value))
+      idx = start + int(np.argmax(area))
+
+    selected.append(idx)
+    anchor = [float(times[idx]), float(values[idx])]
+
+  return np.array(selected, dtype=int), anchor
+
+
+class Resolution:
+  """Downsampled series of all numeric signals with one bucket width, stored in its own signal set."""
+
+  def __init__(self, resolution, res_state):
+    self.resolution = resolution
+    self.width = parse_resolution(resolution)
+    self.set_cid = f"{method}_{resolution}_{sig_set_cid}"
+    # Start of the first bucket that is not final yet, all before it are stored
+    self.start = res_state.get('from')
+    # Last selected point of each signal, for lttb
+    self.anchors = res_state.get('anchors', {})
+
+  def get_state(self):
+    return {
+      'from': self.start,
+      'anchors': self.anchors
+    }
+
+  def _select(self, times, columns, end_id, anchors):
+    docs = {}
+    if self.start is not None:
+      keep = times >= self.start
+      times = times[keep]
+      columns = {cid: column[keep] for cid, column in columns.items()}
+
+    out_signals = entities['signals'][self.set_cid]
+    for cid, column in columns.items():
+      valid = ~np.isnan(column)
+      sig_times = times[valid]
+      sig_values = column[valid]
+      if len(sig_times) == 0:
+        continue
+
+      bucket_ids = sig_times // self.width
+      if method == MINMAX:
+        done = bucket_ids < end_id
+        selected = select_minmax(sig_values[done], bucket_ids[done])
+      else:
+        selected, anchors[cid] = select_lttb(sig_times, sig_values, bucket_ids, anchors.get(cid), end_id)
+
+      field = out_signals[cid]['field']
+      for idx in selected:
+        docs.setdefault(int(sig_times[idx]), {})[field] = float(sig_values[idx])
+
+    return docs
+
+  def process(self, times, columns):
+    """Representative points of the buckets which are complete in the data, their next bucket as well for lttb."""
+    if len(times) == 0:
+      return {}
+
+    # The last bucket may still be incomplete
+    end_id = int(times[-1] // self.width) - (1 if method == LTTB else 0)
+    docs = self._select(times, columns, end_id, self.anchors)
+    if self.start is None or end_id * self.width > self.start:
+      self.start = end_id * self.width
+    return docs
+
+  def finish(self, times, columns):
+    """Representative points of the remaining buckets, they are recomputed by the next run."""
+    return self._select(times, columns, np.inf, dict(self.anchors))
+
+  def store(self, docs):
+    index = entities['signalSets'][self.set_cid]['index']
+    ts_field = entities['signals'][self.set_cid][ts['cid']]['field']
+
+    def actions():
+      for time, doc in docs.items():
+        doc[ts_field] = time
+        yield {
+          "_index": index,
+          "_type": '_doc',
+          "_id": time,
+          "_source": doc
+        }
+
+    helpers.bulk(es, actions())
+
+
+if state is None:
+  state = {}
+
+res_states = state.setdefault('resolutions', {})
+resolutions = {resolution.strip(): None for resolution in params['resolutions'].split(',') if resolution.strip()}
+for resolution in resolutions:
+  resolutions[resolution] = Resolution(resolution, res_states.get(resolution, {}))
+
+for res in resolutions.values():
+  if owned['signalSets'].get(res.set_cid) is None:
+    signals = []
+    for cid, signal in numeric_signals.items():
+      signals.append({
+        "cid": signal['cid'],
+        "name": signal['name'],
+        "description": signal['description'],
+        "namespace": signal['namespace'],
+        "type": signal['type'],
+        "indexed": signal['indexed'],
+        "settings": signal['settings']
+      })
+
+    signals.append({
+      "cid": ts['cid'],
+      "name": ts['name'],
+      "description": ts['description'],
+      "namespace": ts['namespace'],
+      "type": ts['type'],
+      "indexed": ts['indexed'],
+      "settings": ts['settings']
+    })
+
+    ivis.create_signal_set(
+      res.set_cid,
+      sig_set['namespace'],
+      res.set_cid,
+      f"{method} downsampling with resolution '{res.resolution}' for signal set '{sig_set_cid}'",
+      None,
+      signals)
+
+    # State of a removed set does not apply to the new one
+    res.start = None
+    res.anchors = {}
+
+  elif res.start is not None:
+    # Buckets which were not final are recomputed
+    es.delete_by_query(index=entities['signalSets'][res.set_cid]['index'], body={
+      'query': {
+        'range': {
+          entities['signals'][res.set_cid][ts['cid']]['field']: {
+            'gte': res.start
+          }
+        }
+      }
+    })
+
+
+def read_chunks(since):
+  fields = [signal['field'] for signal in numeric_signals.values()]
+  query = {
+    '_source': fields,
+    'docvalue_fields': [{'field': ts['field'], 'format': 'epoch_millis'}],
+    'sort': [{ts['field']: 'asc'}],
+    'query': {"range": {ts['field']: {"gte": since}}} if since is not None else {'match_all': {}}
+  }
+
+  times = []
+  rows = []
+  for hit in helpers.scan(es, index=sig_set['index'], preserve_order=True, query=query, scroll='5m', size=10000):
+    times.append(float(hit['fields'][ts['field']][0]))
+    rows.append([hit['_source'].get(field) for field in fields])
+    if len(times) == chunk_size:
+      yield to_arrays(times, rows)
+      times = []
+      rows = []
+
+  yield to_arrays(times, rows)
+
+
+def to_arrays(times, rows):
+  values = np.array(rows, dtype=float).reshape(len(rows), len(numeric_signals))
+  return np.array(times), {cid: values[:, idx] for idx, cid in enumerate(numeric_signals)}
+
+
+def concat(first, second):
+  return np.concatenate((first[0], second[0])), {cid: np.concatenate((first[1][cid], second[1][cid])) for cid in first[1]}
+
+
+starts = [res.start for res in resolutions.values()]
+since = None if any(start is None for start in starts) else min(starts)
+
+# Records of buckets that are not final yet are carried over to the next chunk
+carry = to_arrays([], [])
+processed = 0
+for chunk in read_chunks(since):
+  times, columns = concat(carry, chunk)
+  for res in resolutions.values():
+    res.store(res.process(times, columns))
+    res_states[res.resolution] = res.get_state()
+
+  keep = times >= min(res.start for res in resolutions.values()) if len(times) > 0 else np.zeros(0, dtype=bool)
+  carry = times[keep], {cid: column[keep] for cid, column in columns.items()}
+
+  ivis.store_state(state)
+  processed += len(chunk[0])
+  ivis.report_progress(processed)
+  ivis.check_cancelled()
+
+for res in resolutions.values():
+  res.store(res.finish(*carry))
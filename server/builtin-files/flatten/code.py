@@ -0,0 +1,216 @@
+from ivis import ivis
+from ivis.alignment import align, union_grid, AGGREGATE, PREVIOUS
+from elasticsearch import helpers
+import numpy as np
+import re
+import warnings
+
+es = ivis.elasticsearch
+state = ivis.state
+
+params = ivis.params
+entities = ivis.entities
+owned = ivis.owned
+
+sig_set = params['signalSet']
+ns = sig_set['namespace'] if sig_set['namespace'] is not None and str(sig_set['namespace']).isdigit() else 1
+
+UNITS = {'ms': 1, 's': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000, 'w': 7 * 24 * 60 * 60 * 1000}
+
+
+def parse_duration(duration):
+  """Duration in milliseconds given like 500ms, 30s or 5m."""
+  match = re.fullmatch(r'(\d+)(ms|s|m|h|d|w)', duration.strip())
+  if match is None:
+    raise ValueError(f"Tolerance '{duration}' not valid, expected a number followed by one of {', '.join(UNITS)}")
+  return int(match.group(1)) * UNITS[match.group(2)]
+
+
+method = params['resolutionMethod']
+# How the values of a set are placed on time points of the other sets, records of the sets rarely share a time point
+fill = params.get('fillMethod') or AGGREGATE
+tolerance = parse_duration(params['tolerance']) if params.get('tolerance') else None
+sets = params['sets']
+
+ts_cid = 'ts'
+
+if owned['signalSets'].get(sig_set['cid']) is None:
+  signals= {}
+  for sigSet in sets:
+    for signal in sigSet['signals']:
+      if signals.get(signal) is not None:
+        if signals[signal]['type'] != entities['signals'][sigSet['cid']][signal]['type']:
+          raise Exception(f"Signals with same cid have to share type")
+      else:
+        signals[signal] = entities['signals'][sigSet['cid']][signal]
+
+  signals[ts_cid] = {
+    "cid": ts_cid,
+    "name": "Timestamp",
+    "description": "Timestamp of the flattened record",
+    "namespace": ns,
+    "type": "date",
+    "indexed": False,
+    "settings": {}
+  }
+
+  ivis.create_signal_set(sig_set['cid'], ns, sig_set['name'], sig_set['description'], None, list(signals.values()))
+
+  state = {}
+  state['last'] = None
+  ivis.store_state(state)
+
+if state is None:
+  state = {}
+
+# First time point of the output that is recomputed, its value may have changed with new records
+last = state.get('last')
+
+
+def to_arrays(hits, ts_field, fields):
+  timestamps = []
+  rows = []
+  for hit in hits:
+    source = hit['_source']
+    timestamps.append(float(hit['fields'][ts_field][0]))
+    rows.append([source.get(field) for field in fields])
+
+  return np.array(timestamps), np.array(rows, dtype=float).reshape(len(rows), len(fields))
+
+
+def read_set(sigSet):
+  """Timestamps in epoch milliseconds and values of the chosen signals of a set, sorted by time."""
+  set_signals = entities['signals'][sigSet['cid']]
+  index = entities['signalSets'][sigSet['cid']]['index']
+  ts_field = set_signals[sigSet['ts']]['field']
+  fields = [set_signals[signal]['field'] for signal in sigSet['signals']]
+
+  def get_query(query_content):
+    return {
+      '_source': fields,
+      'docvalue_fields': [{'field': ts_field, 'format': 'epoch_millis'}],
+      'sort': [{ts_field: 'asc'}],
+      'query': query_content
+    }
+
+  if last is None:
+    query_content = {'match_all': {}}
+  elif fill == AGGREGATE:
+    # Records within tolerance before the first recomputed point fall into its window
+    query_content = {"range": {ts_field: {"gte": int(last - (tolerance or 0))}}}
+  else:
+    query_content = {"range": {ts_field: {"gte": int(last)}}}
+
+  hits = list(helpers.scan(es, index=index, preserve_order=True, query=get_query(query_content), scroll='5m', size=10000))
+
+  if last is not None and fill != AGGREGATE:
+    # Filling uses the neighbouring records only, the last records with each signal before the recomputed points
+    # are enough, the last two give the gap between records of the signal
+    previous = {}
+    for field in fields:
+      previous_query = get_query({"bool": {"filter": [{"range": {ts_field: {"lt": int(last)}}}, {"exists": {"field": field}}]}})
+      previous_query['sort'] = [{ts_field: 'desc'}]
+      previous_query['size'] = 2
+      for hit in es.search(index=index, body=previous_query)['hits']['hits']:
+        previous[hit['_id']] = hit
+    hits = sorted(previous.values(), key=lambda hit: float(hit['fields'][ts_field][0])) + hits
+
+  return to_arrays(hits, ts_field, fields)
+
+
+def resolve(timestamps, values, grid):
+  """
+  Values of the signals of one set on the grid, records at the same time point are combined with the resolution
+  method first. Returns them with the time of the last record of each signal and the gap before it.
+  """
+  if fill == AGGREGATE:
+    resolved = align(timestamps, values, grid, method=AGGREGATE, tolerance=tolerance or 0, aggregation=method)
+  else:
+    own_grid = np.unique(timestamps)
+    merged = align(timestamps, values, own_grid, method=AGGREGATE, tolerance=0, aggregation=method)
+    resolved = np.full((len(grid), values.shape[1]), np.nan)
+    for idx in range(values.shape[1]):
+      # Records without the signal are skipped, the signal is filled from the records that have it
+      present = ~np.isnan(merged[:, idx])
+      resolved[:, idx] = align(own_grid[present], merged[present, idx], grid, method=fill, tolerance=tolerance)
+
+  ends = []
+  for idx in range(values.shape[1]):
+    present = timestamps[~np.isnan(values[:, idx])]
+    if len(present) > 0:
+      ends.append((present[-1], present[-1] - present[-2] if len(present) > 1 else None))
+  return resolved, ends
+
+
+def get_next_last(grid, ends):
+  """
+  First time point to recompute in the next run, assuming records of the sets arrive in time order.
+  Nearest and linear values after the last record of a signal change once its next record arrives.
+  A signal without a record for twice its last gap is considered stalled, only its last gap is recomputed,
+  otherwise a signal that stopped would have every following run recompute everything since its last record.
+  """
+  grid_end = grid[-1]
+  if fill == AGGREGATE:
+    return grid_end - (tolerance or 0)
+  if fill == PREVIOUS or not ends:
+    return grid_end
+
+  next_last = grid_end
+  for end, gap in ends:
+    if gap is not None:
+      next_last = min(next_last, max(end, grid_end - 2 * gap))
+  if tolerance is not None:
+    # Records further than tolerance do not affect the value
+    next_last = max(next_last, grid_end - tolerance)
+  return next_last
+
+
+series = [read_set(sigSet) for sigSet in sets]
+grid = union_grid(*[timestamps for timestamps, _ in series])
+if last is not None:
+  grid = grid[grid >= last]
+
+if len(grid) > 0:
+  # Signals of each set are resolved on the grid, then the same signals across the sets
+  aligned = {}
+  ends = []
+  for sigSet, (timestamps, values) in zip(sets, series):
+    resolved, set_ends = resolve(timestamps, values, grid)
+    ends.extend(set_ends)
+    for idx, signal in enumerate(sigSet['signals']):
+      aligned.setdefault(signal, []).append(resolved[:, idx])
+
+  reduce = {'avg': np.nanmean, 'min': np.nanmin, 'max': np.nanmax}[method]
+  out_signals = entities['signals'][sig_set['cid']]
+  columns = {}
+  with np.errstate(all='ignore'), warnings.catch_warnings():
+    # Time points where none of the sets has the signal stay empty, numpy warns about them
+    warnings.simplefilter('ignore', RuntimeWarning)
+    for signal, candidates in aligned.items():
+      columns[out_signals[signal]['field']] = candidates[0] if len(candidates) == 1 else reduce(np.vstack(candidates), axis=0)
+
+  index = entities['signalSets'][sig_set['cid']]['index']
+  ts_field = out_signals[ts_cid]['field']
+
+  def docs():
+    for idx, time in enumerate(grid):
+      time = int(time)
+      doc = {ts_field: time}
+      for field, column in columns.items():
+        if not np.isnan(column[idx]):
+          doc[field] = float(column[idx])
+
+      yield {
+        "_index": index,
+        "_type": '_doc',
+        "_id": time,
+        "_source": doc
+      }
+
+  helpers.bulk(es, docs())
+
+  last = int(get_next_last(grid, ends))
+
+# Request to store state
+state['last'] = last
+ivis.store_state(state)
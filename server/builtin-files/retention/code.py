@@ -0,0 +1,140 @@
+from ivis import ivis
+
+es = ivis.elasticsearch
+state = ivis.state
+params= ivis.params
+entities= ivis.entities
+
+sig_set_cid = params['signalSet']
+sig_set = entities['signalSets'][sig_set_cid]
+ts = entities['signals'][sig_set_cid][params['ts']]
+interval = params['interval']
+age = params['age']
+# Buckets checked and deleted in one batch, at least two as the last one is carried over to the next batch
+batch_size = max(params.get('batchSize') or 1000, 2)
+# Throttling of the deletion, unlimited when not set
+requests_per_second = params.get('requestsPerSecond')
+
+# Raw data can only be removed once they are aggregated by the aggregation job with the same interval
+agg_set_cid = f"aggregation_{interval}_{sig_set_cid}"
+agg_set = entities['signalSets'].get(agg_set_cid)
+if agg_set is None:
+  print(f"Aggregation '{agg_set_cid}' not found, nothing removed")
+  exit()
+
+agg_ts = entities['signals'][agg_set_cid][ts['cid']]
+
+if state is None:
+  state = {}
+
+# Everything before the watermark was already removed
+watermark = state.get('watermark')
+
+# The last aggregated bucket is recomputed by every aggregation run, so only the buckets before it are final
+res = es.search(index=agg_set['index'], body={
+  'size': 0,
+  'aggs': {
+    'last': {
+      'max': {
+        'field': agg_ts['field']
+      }
+    }
+  }
+})
+last_aggregated = res['aggregations']['last']['value']
+if last_aggregated is None:
+  print(f"Aggregation '{agg_set_cid}' is empty, nothing removed")
+  exit()
+
+filters = [
+  {"range": {ts['field']: {"lt": f"now-{age}"}}},
+  {"range": {ts['field']: {"lt": int(last_aggregated)}}}
+]
+if watermark is not None:
+  filters.append({"range": {ts['field']: {"gte": watermark}}})
+
+
+def get_bucket_keys(after):
+  composite = {
+    "size": batch_size,
+    "sources": [{
+      "ts": {
+        "date_histogram": {
+          "field": ts['field'],
+          "interval": interval
+        }
+      }
+    }]
+  }
+  if after is not None:
+    composite['after'] = {'ts': after}
+
+  res = es.search(index=sig_set['index'], body={
+    'size': 0,
+    'query': {
+      'bool': {
+        'filter': filters
+      }
+    },
+    'aggs': {
+      'buckets': {
+        'composite': composite
+      }
+    }
+  })
+
+  return [bucket['key']['ts'] for bucket in res['aggregations']['buckets']['buckets']]
+
+
+def get_aggregated_keys(keys):
+  res = es.search(index=agg_set['index'], body={
+    'size': len(keys),
+    '_source': False,
+    'docvalue_fields': [{'field': agg_ts['field'], 'format': 'epoch_millis'}],
+    'query': {
+      'terms': {
+        agg_ts['field']: keys
+      }
+    }
+  })
+
+  return {int(float(hit['fields'][agg_ts['field']][0])) for hit in res['hits']['hits']}
+
+
+def delete_before(end):
+  # Removal is done by the server, records of non-computed signal sets are kept in its storage as well
+  # and would be brought back to the index by reindexing
+  return ivis.remove_records(sig_set_cid, ts['cid'], end, requests_per_second)
+
+
+deleted = 0
+after = None if watermark is None else watermark - 1
+while True:
+  keys = get_bucket_keys(after)
+  if not keys:
+    break
+
+  aggregated = get_aggregated_keys(keys)
+  missing = next((key for key in keys if key not in aggregated), None)
+
+  # Buckets are removed whole, the last one of the batch may continue past the cutoff so it is left to the next batch
+  end = missing if missing is not None else keys[-1]
+  if watermark is None or end > watermark:
+    deleted += delete_before(end)
+    watermark = end
+    state['watermark'] = watermark
+    ivis.store_state(state)
+
+  if missing is not None:
+    print(f"Bucket {missing} is not aggregated yet, stopping")
+    break
+
+  if len(keys) < batch_size:
+    break
+
+  # Next batch starts with the bucket that was left out
+  after = keys[-1] - 1
+  ivis.report_progress(deleted, force=True)
+  ivis.check_cancelled()
+
+print(f"Removed {deleted} records before {watermark}")
@@ -0,0 +1,59 @@
+const moment = require('moment');
+const {BuiltinTaskNames, TaskSource} = require('../../../shared/tasks');
+
+function intervalStrToMiliseconds(intervalStr) {
+    const unit = intervalStr.slice(-1);
+    const value = parseInt(intervalStr.slice(0, -1));
+    return moment.duration(value, unit).asMilliseconds();
+}
+
+exports.up = (knex, Promise) => (async () => {
+    // Signal set holding the aggregation, one aggregation job may aggregate several signal sets
+    await knex.schema.table('aggregation_jobs', table => {
+        table.integer('agg_set').unsigned().references('signal_sets.id').onDelete('SET NULL');
+    });
+
+    // Aggregation sets already created by aggregation jobs are registered
+    const aggJobs = await knex('jobs')
+        .select('jobs.id', 'jobs.params')
+        .innerJoin('tasks', 'tasks.id', 'jobs.task')
+        .where('tasks.name', BuiltinTaskNames.AGGREGATION)
+        .whereIn('tasks.source', [TaskSource.BUILTIN, TaskSource.SYSTEM]);
+
+    for (const job of aggJobs) {
+        const params = JSON.parse(job.params);
+        const prefix = `aggregation_${params.interval}_`;
+
+        const ownedSets = await knex('signal_sets')
+            .select('signal_sets.id', 'signal_sets.cid')
+            .innerJoin('signal_sets_owners', 'signal_sets_owners.set', 'signal_sets.id')
+            .where('signal_sets_owners.job', job.id);
+
+        for (const aggSet of ownedSets) {
+            if (!aggSet.cid.startsWith(prefix)) {
+                continue;
+            }
+
+            const sigSet = await knex('signal_sets').where('cid', aggSet.cid.slice(prefix.length)).first();
+            if (!sigSet) {
+                continue;
+            }
+
+            const existing = await knex('aggregation_jobs').where({set: sigSet.id, job: job.id}).first();
+            if (existing) {
+                await knex('aggregation_jobs').where({set: sigSet.id, job: job.id}).update({agg_set: aggSet.id});
+            } else {
+                await knex('aggregation_jobs').insert({
+                    set: sigSet.id,
+                    job: job.id,
+                    interval: intervalStrToMiliseconds(params.interval),
+                    offset: params.offset || null,
+                    agg_set: aggSet.id
+                });
+            }
+        }
+    }
+})();
+
+exports.down = (knex, Promise) => (async () => {
+});
@@ -1,7 +1,9 @@
 'use strict';
 
+const moment = require('moment');
 const elasticsearch = require('../elasticsearch');
 const {SignalSource, getTypesBySource, SignalType} = require('../../../shared/signals');
+const {SignalSetType, SignalSetPartitioning} = require('../../../shared/signal-sets');
 
 const  COPY_ID_PIPELINE = 'copy-id';
 
@@ -12,6 +14,34 @@ function getIndexName(sigSet) {
 
 const getFieldName = (fieldId) => 's' + fieldId;
 
+// Suffix formats of the partition indices, the same formats are used by the ivis python package
+const partitionFormats = {
+    [SignalSetPartitioning.YEAR]: 'YYYY',
+    [SignalSetPartitioning.MONTH]: 'YYYY.MM',
+    [SignalSetPartitioning.DAY]: 'YYYY.MM.DD'
+};
+
+// Returns partitioning of a signal set, null if the set is stored in a single index
+// Only computed sets, whose records are written by jobs, can be partitioned
+function getPartitioning(sigSet) {
+    if (sigSet.type !== SignalSetType.COMPUTED) {
+        return null;
+    }
+
+    const settings = typeof sigSet.settings === 'string' ? JSON.parse(sigSet.settings) : sigSet.settings;
+    const partitioning = settings && settings.partitioning;
+    return partitionFormats[partitioning] ? partitioning : null;
+}
+
+// Partitioned signal sets are stored in indices per time period, the index name of the set is an alias of all of them
+function getPartitionIndexName(sigSet, timestamp) {
+    return getIndexName(sigSet) + '-' + moment.utc(timestamp).format(partitionFormats[getPartitioning(sigSet)]);
+}
+
+function getPartitionsPattern(sigSet) {
+    return getIndexName(sigSet) + '-*';
+}
+
 const fieldTypes = {
     [SignalType.INTEGER]: 'integer',
     [SignalType.LONG]: 'long',
@@ -25,9 +55,7 @@ const fieldTypes = {
     [SignalType.BLOB]: 'binary',
 };
 
-async function createIndex(sigSet, signalByCidMap) {
-    const indexName = getIndexName(sigSet);
-
+function getMappingProperties(signalByCidMap) {
     const properties = {};
     for (const fieldCid in signalByCidMap) {
         const field = signalByCidMap[fieldCid];
@@ -40,6 +68,42 @@ async function createIndex(sigSet, signalByCidMap) {
         type: fieldTypes[SignalType.KEYWORD]
     };
 
+    return properties;
+}
+
+async function createIndex(sigSet, signalByCidMap) {
+    const indexName = getIndexName(sigSet);
+    const properties = getMappingProperties(signalByCidMap);
+
+    if (getPartitioning(sigSet)) {
+        // Partitions are created on the first write from the template, which also adds them to the alias
+        await elasticsearch.indices.putTemplate({
+            name: indexName,
+            body: {
+                index_patterns: [getPartitionsPattern(sigSet)],
+                aliases: {
+                    [indexName]: {}
+                },
+                mappings: {
+                    _doc: {
+                        properties
+                    }
+                },
+                settings: {
+                    number_of_shards: 1,
+                    default_pipeline: COPY_ID_PIPELINE
+                }
+            }
+        });
+
+        // Current partition is created right away so that the alias resolves even before the first write
+        const currentPartition = getPartitionIndexName(sigSet, Date.now());
+        if (!await elasticsearch.indices.exists({index: currentPartition})) {
+            await elasticsearch.indices.create({index: currentPartition});
+        }
+        return;
+    }
+
     await elasticsearch.indices.create({
         index: indexName,
         body: {
@@ -73,12 +137,33 @@ async function extendMapping(sigSet, fields) {
             properties
         }
     });
+
+    if (getPartitioning(sigSet)) {
+        // Future partitions have to get the extended mapping too
+        const templates = await elasticsearch.indices.getTemplate({name: indexName});
+        const template = templates[indexName];
+        Object.assign(template.mappings._doc.properties, properties);
+        await elasticsearch.indices.putTemplate({name: indexName, body: template});
+    }
+}
+
+async function removeIndex(sigSet) {
+    const indexName = getIndexName(sigSet);
+    if (getPartitioning(sigSet)) {
+        await elasticsearch.indices.deleteTemplate({name: indexName, ignore: [404]});
+        await elasticsearch.indices.delete({index: getPartitionsPattern(sigSet)});
+    } else {
+        await elasticsearch.indices.delete({index: indexName});
+    }
 }
 
 module.exports = {
     getIndexName,
     getFieldName,
+    getPartitioning,
+    getPartitionIndexName,
     createIndex,
     extendMapping,
+    removeIndex,
     COPY_ID_PIPELINE
 };
@@ -4,14 +4,15 @@ const moment = require('moment');
 const elasticsearch = require('../elasticsearch');
 const {SignalType, SignalSource,getSigCidForAggSigStat} = require('../../../shared/signals');
 const {SignalSetKind} = require('../../../shared/signal-sets');
-const {getIndexName, getFieldName} = require('./elasticsearch-common');
+const {getIndexName, getFieldName, getPartitioning} = require('./elasticsearch-common');
 
 const handlebars = require('handlebars');
 const log = require('../log');
 
-async function executeElsQry(index, body) {
+async function executeElsQry(index, body, params = {}) {
     try {
         const result = await elasticsearch.search({
+            ...params,
             index,
             body
         });
@@ -186,6 +187,10 @@ class QueryProcessor {
         // Complete substitution when possible
         this.indexName = this.aggSigSetIndexName || this.origSigSetindexName;
         this.signalMap = this.aggSigSetSignalMap || this.origSigSetSignalMap;
+
+        // Partitions outside of the queried range are skipped by the can_match phase, which ES runs only above this shard count
+        const queriedSigSet = query.aggSigSet ? query.aggSigSet.sigSet : query.sigSet;
+        this.searchParams = getPartitioning(queriedSigSet) ? {pre_filter_shard_size: 1} : {};
     }
 
     createElsScript(field) {
@@ -328,7 +333,7 @@ class QueryProcessor {
                 }
             };
 
-            const minMaxResp = await executeElsQry(this.indexName, minMaxQry);
+            const minMaxResp = await executeElsQry(this.indexName, minMaxQry, this.searchParams);
 
             return {
                 min: minMaxResp.aggregations.min_value.value,
@@ -840,7 +845,7 @@ class QueryProcessor {
         };
 
 
-        const elsResp = await executeElsQry(this.indexName, elsQry);
+        const elsResp = await executeElsQry(this.indexName, elsQry, this.searchParams);
 
         return {
             tsSigCid: this.tsSigCid,
@@ -888,7 +893,7 @@ class QueryProcessor {
             elsQry.sort = this.createElsSort(query.docs.sort);
         }
 
-        const elsResp = await executeElsQry(this.indexName, elsQry);
+        const elsResp = await executeElsQry(this.indexName, elsQry, this.searchParams);
 
         const result = {
             tsSigCid: this.tsSigCid,
@@ -935,7 +940,7 @@ class QueryProcessor {
             aggs: this.createSignalAggs(query.summary.signals)
         };
 
-        const elsResp = await executeElsQry(this.indexName, elsQry);
+        const elsResp = await executeElsQry(this.indexName, elsQry, this.searchParams);
 
         return {
             summary: this.processSignalAggs(query.summary.signals, elsResp.aggregations)
@@ -5,7 +5,7 @@ const {enforce} = require('../helpers');
 const interoperableErrors = require('../../../shared/interoperable-errors');
 const {IndexMethod} = require('../../../shared/signals');
 const {SignalSetType} = require('../../../shared/signal-sets');
-const {getIndexName, getFieldName, createIndex, extendMapping, COPY_ID_PIPELINE} = require('./elasticsearch-common');
+const {getIndexName, getFieldName, getPartitioning, createIndex, extendMapping, removeIndex, COPY_ID_PIPELINE} = require('./elasticsearch-common');
 const contextHelpers = require('../context-helpers');
 
 const signalSets = require('../../models/signal-sets');
@@ -145,7 +145,7 @@ async function onRemoveField(sigSet, fieldCid) {
 async function onRemoveStorage(sigSet) {
     cancelIndex(sigSet);
     try {
-        await elasticsearch.indices.delete({index: getIndexName(sigSet)});
+        await removeIndex(sigSet);
     } catch (err) {
         if (err.body && err.body.error && err.body.error.type === 'index_not_found_exception') {
             log.verbose("Indexer", "Index does not exist during removal. Ignoring...");
@@ -157,7 +157,14 @@ async function onRemoveStorage(sigSet) {
     return {};
 }
 
+// Index name of a partitioned signal set is an alias of several indices, which can't be written through
+function enforceNotPartitioned(sigSet) {
+    enforce(!getPartitioning(sigSet), `Records of partitioned signal set ${sigSet.cid} can only be written by its job to the partition indices`);
+}
+
 async function onInsertRecords(sigSetWithSigMap, records) {
+    enforceNotPartitioned(sigSetWithSigMap);
+
     // If currently reindex is in progress, then if it has been already deleted, records will be inserted from here
     // It has not been deleted, then it will reindex the new records as well
 
@@ -201,6 +208,7 @@ async function onInsertRecords(sigSetWithSigMap, records) {
 }
 
 async function onUpdateRecord(sigSetWithSigMap, existingRecordId, record) {
+    enforceNotPartitioned(sigSetWithSigMap);
     const indexName = getIndexName(sigSetWithSigMap);
 
     const signalByCidMap = sigSetWithSigMap.signalByCidMap;
@@ -238,6 +246,7 @@ async function onUpdateRecord(sigSetWithSigMap, existingRecordId, record) {
 }
 
 async function onRemoveRecord(sigSet, recordId) {
+    enforceNotPartitioned(sigSet);
     const indexName = getIndexName(sigSet);
 
     try {
@@ -257,6 +266,43 @@ async function onRemoveRecord(sigSet, recordId) {
     return {};
 }
 
+async function onRemoveRecordsBefore(sigSetWithSigMap, tsCid, end, requestsPerSecond) {
+    const indexName = getIndexName(sigSetWithSigMap);
+    const tsField = getFieldName(sigSetWithSigMap.signalByCidMap[tsCid].id);
+
+    // Removal of many records takes longer than the request timeout, so it runs as a task which is watched
+    const task = await elasticsearch.deleteByQuery({
+        index: indexName,
+        conflicts: 'proceed',
+        requestsPerSecond: requestsPerSecond || -1,
+        waitForCompletion: false,
+        body: {
+            query: {
+                range: {
+                    [tsField]: {
+                        lt: end
+                    }
+                }
+            }
+        }
+    });
+
+    let status;
+    while (!(status = await elasticsearch.tasks.get({taskId: task.task})).completed) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+
+    if (status.error) {
+        throw new Error(`Removal of records of signal set ${sigSetWithSigMap.cid} failed: ${status.error.reason}`);
+    }
+    if (status.response.failures.length > 0 || status.response.canceled) {
+        throw new Error(`Removal of records of signal set ${sigSetWithSigMap.cid} was not complete`);
+    }
+
+    emitter.emit(EventTypes.REMOVE, sigSetWithSigMap.cid);
+    return {removed: status.response.deleted};
+}
+
 
 // Cancel possible pending or running reindex of this signal set
 function cancelIndex(sigSet) {
@@ -283,6 +329,7 @@ module.exports.onRemoveStorage = onRemoveStorage;
 module.exports.onInsertRecords = onInsertRecords;
 module.exports.onUpdateRecord = onUpdateRecord;
 module.exports.onRemoveRecord = onRemoveRecord;
+module.exports.onRemoveRecordsBefore = onRemoveRecordsBefore;
 module.exports.index = index;
 module.exports.init = init;
 module.exports.getDocsCount = getDocsCount;
@@ -1,5 +1,5 @@
 "use strict";
-const {getIndexName} = require('./indexers/elasticsearch-common');
+const {getIndexName, getPartitioning} = require('./indexers/elasticsearch-common');
 
 const allowedKeysCreate = new Set(['cid', 'type', 'name', 'description', 'namespace', 'record_id_template', 'settings', 'kind', 'metadata']);
 const allowedKeysUpdate = new Set(['name', 'description', 'namespace', 'record_id_template', 'settings', 'kind', 'metadata']);
@@ -8,6 +8,8 @@ function getSignalSetEntitySpec(signalSet) {
     return {
         ...signalSet,
         index: getIndexName(signalSet),
+        // Writes to partitioned sets have to go to the partition index of the record, the index is only an alias
+        partitioning: getPartitioning(signalSet),
     };
 }
 
@@ -0,0 +1,198 @@
+"""
+Alignment of time series sampled at different rates onto a common time grid.
+
+All operations work on whole arrays (searchsorted, cumulative sums, sparse tables), so the cost is
+O((n + m) log n) in NumPy for n samples and m grid points, with no per-record Python code.
+Timestamps have to be sorted ascending, either numbers (e.g. epoch milliseconds) or numpy datetime64.
+Values are 1-D arrays or 2-D arrays with one row per timestamp; float results use NaN for missing values.
+"""
+import numpy as np
+
+PREVIOUS = 'previous'
+LINEAR = 'linear'
+NEAREST = 'nearest'
+AGGREGATE = 'aggregate'
+
+METHODS = (PREVIOUS, LINEAR, NEAREST, AGGREGATE)
+AGGREGATIONS = ('avg', 'min', 'max', 'sum', 'count')
+
+
+def _as_numeric(timestamps):
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        return timestamps.astype('datetime64[ns]').view('int64')
+    return timestamps
+
+
+def _tolerance_as_numeric(tolerance):
+    if isinstance(tolerance, np.timedelta64):
+        return tolerance.astype('timedelta64[ns]').astype('int64')
+    return tolerance
+
+
+def _take(values, idx, valid):
+    """Rows of values at idx, NaN where valid is False."""
+    result = values[np.where(valid, idx, 0)]
+    result[~valid] = np.nan
+    return result
+
+
+def union_grid(*timestamps):
+    """Sorted union of all given timestamp arrays."""
+    return np.unique(np.concatenate([np.asarray(ts) for ts in timestamps]))
+
+
+def regular_grid(start, end, step):
+    """Grid from start to end (inclusive when end falls on the grid) with a constant step."""
+    return np.arange(start, end + step, step)[:int((end - start) // step) + 1]
+
+
+def _previous(ts, values, grid, tolerance):
+    idx = np.searchsorted(ts, grid, side='right') - 1
+    valid = idx >= 0
+    if tolerance is not None:
+        valid &= grid - ts[np.maximum(idx, 0)] <= tolerance
+    return _take(values, idx, valid)
+
+
+def _nearest(ts, values, grid, tolerance):
+    right = np.minimum(np.searchsorted(ts, grid), len(ts) - 1)
+    left = np.maximum(right - 1, 0)
+    use_left = np.abs(grid - ts[left]) <= np.abs(ts[right] - grid)
+    idx = np.where(use_left, left, right)
+    valid = np.ones(len(grid), dtype=bool)
+    if tolerance is not None:
+        valid &= np.abs(ts[idx] - grid) <= tolerance
+    return _take(values, idx, valid)
+
+
+def _linear(ts, values, grid, tolerance):
+    right = np.searchsorted(ts, grid)
+    exact = (right < len(ts)) & (ts[np.minimum(right, len(ts) - 1)] == grid)
+    valid = exact | ((right > 0) & (right < len(ts)))
+    right = np.minimum(right, len(ts) - 1)
+    left = np.where(exact, right, np.maximum(right - 1, 0))
+    if tolerance is not None:
+        # Interpolation is not done over gaps in the data wider than tolerance
+        valid &= exact | (ts[right] - ts[left] <= tolerance)
+
+    span = (ts[right] - ts[left]).astype(float)
+    weight = np.divide((grid - ts[left]).astype(float), span, out=np.zeros(len(grid)), where=span != 0)
+    weight = weight.reshape((-1,) + (1,) * (values.ndim - 1))
+    result = values[left] * (1 - weight) + values[right] * weight
+    result[~valid] = np.nan
+    return result
+
+
+def _sparse_table(values, reduce):
+    """Levels of precomputed reductions over windows of length 2**level for O(1) range queries."""
+    table = [values]
+    width = 1
+    while 2 * width <= len(values):
+        prev = table[-1]
+        table.append(reduce(prev[:-width], prev[width:]))
+        width *= 2
+    return table
+
+
+def _range_reduce(values, lo, hi, reduce, fill):
+    """reduce over values[lo:hi] for every pair of bounds, all at once."""
+    lengths = hi - lo
+    nonempty = lengths > 0
+    result = np.full((len(lo),) + values.shape[1:], np.nan)
+    if not nonempty.any():
+        return result
+
+    table = _sparse_table(np.where(np.isnan(values), fill, values), reduce)
+    level = np.zeros(len(lo), dtype=int)
+    level[nonempty] = np.log2(lengths[nonempty]).astype(int)
+    for lvl in np.unique(level[nonempty]):
+        sel = nonempty & (level == lvl)
+        width = 1 << lvl
+        result[sel] = reduce(table[lvl][lo[sel]], table[lvl][hi[sel] - width])
+
+    # Windows that contain only missing values
+    result[result == fill] = np.nan
+    return result
+
+
+def _aggregate(ts, values, grid, tolerance, aggregation):
+    tolerance = 0 if tolerance is None else tolerance
+    lo = np.searchsorted(ts, grid - tolerance, side='left')
+    hi = np.searchsorted(ts, grid + tolerance, side='right')
+
+    if aggregation == 'min':
+        return _range_reduce(values, lo, hi, np.minimum, np.inf)
+    if aggregation == 'max':
+        return _range_reduce(values, lo, hi, np.maximum, -np.inf)
+
+    missing = np.isnan(values)
+    zeros = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate((zeros, np.cumsum(np.where(missing, 0, values), axis=0)))
+    counts = np.concatenate((zeros, np.cumsum(~missing, axis=0)))
+    count = counts[hi] - counts[lo]
+
+    if aggregation == 'count':
+        return count
+    total = sums[hi] - sums[lo]
+    total[count == 0] = np.nan
+    if aggregation == 'sum':
+        return total
+    return total / np.where(count == 0, 1, count)
+
+
+def align(timestamps, values, grid, method=PREVIOUS, tolerance=None, aggregation='avg'):
+    """
+    Resample one series onto grid.
+
+    :param timestamps: sorted timestamps of the series
+    :param values: values of the series, 1-D or 2-D with one row per timestamp
+    :param grid: sorted timestamps to resample onto
+    :param method: 'previous' holds the last known value, 'nearest' takes the closest sample,
+        'linear' interpolates between the neighbouring samples, 'aggregate' combines all samples within tolerance
+    :param tolerance: for 'previous' and 'nearest' the maximal distance of the used sample, for 'linear'
+        the maximal gap between samples to interpolate over and for 'aggregate' the half-width of the window
+        around each grid point (0 aggregates samples at exactly the same time)
+    :param aggregation: one of 'avg', 'min', 'max', 'sum', 'count', used by the 'aggregate' method
+    :return: float array of resampled values with the first dimension matching grid
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown alignment method '{method}'")
+    if method == AGGREGATE and aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation '{aggregation}'")
+
+    ts = _as_numeric(timestamps)
+    grid = _as_numeric(grid)
+    values = np.asarray(values, dtype=float)
+    tolerance = _tolerance_as_numeric(tolerance)
+
+    if len(ts) != len(values):
+        raise ValueError('Timestamps and values have to be of the same length')
+
+    if len(ts) == 0:
+        if method == AGGREGATE and aggregation == 'count':
+            return np.zeros((len(grid),) + values.shape[1:])
+        return np.full((len(grid),) + values.shape[1:], np.nan)
+
+    if method == PREVIOUS:
+        return _previous(ts, values, grid, tolerance)
+    if method == NEAREST:
+        return _nearest(ts, values, grid, tolerance)
+    if method == LINEAR:
+        return _linear(ts, values, grid, tolerance)
+    return _aggregate(ts, values, grid, tolerance, aggregation)
+
+
+def align_many(series, grid=None, method=PREVIOUS, tolerance=None, aggregation='avg'):
+    """
+    Resample several series onto a common grid.
+
+    :param series: iterable of (timestamps, values) pairs, see align
+    :param grid: sorted timestamps to resample onto, the union of all timestamps of the series when None
+    :return: tuple of the grid and list of resampled values in the order of series
+    """
+    series = [(np.asarray(ts), values) for ts, values in series]
+    if grid is None:
+        grid = union_grid(*[ts for ts, _ in series])
+
+    return grid, [align(ts, values, grid, method, tolerance, aggregation) for ts, values in series]
@@ -0,0 +1,110 @@
+from collections.abc import MutableMapping
+
+
+class LazyMapping(MutableMapping):
+    """
+    Mapping that loads entries missing on access with the given function and caches them.
+    The load function raises KeyError for entries that don't exist, such misses are cached as well.
+    Iteration goes over the entries loaded so far.
+    """
+
+    def __init__(self, data, load):
+        self._data = dict(data)
+        self._load = load
+        self._missing = set()
+
+    def __getitem__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            pass
+
+        if key in self._missing:
+            raise KeyError(key)
+
+        try:
+            value = self._load(key)
+        except KeyError:
+            self._missing.add(key)
+            raise
+
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._missing.discard(key)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._data!r})'
+
+    def is_loaded(self, key):
+        return key in self._data
+
+
+class SignalsOfSet(LazyMapping):
+    """Signals of one signal set. Unless all signals were received upfront, they are loaded at once on the first miss."""
+
+    def __init__(self, data, complete, load_all):
+        super().__init__(data, self._load_missing)
+        self._complete = complete
+        self._load_all = load_all
+
+    def _ensure_complete(self):
+        if not self._complete:
+            for cid, signal in self._load_all().items():
+                self._data.setdefault(cid, signal)
+            self._complete = True
+
+    def _load_missing(self, key):
+        self._ensure_complete()
+        return self._data[key]
+
+    def __iter__(self):
+        self._ensure_complete()
+        return super().__iter__()
+
+    def __len__(self):
+        self._ensure_complete()
+        return super().__len__()
+
+
+class SignalsBySet(LazyMapping):
+    """Signals keyed by the cid of their signal set, signals of a set not sent with the job are loaded on its first access."""
+
+    def __init__(self, data, complete_signal_sets, load_signals):
+        self._load_signals = load_signals
+        super().__init__({}, lambda set_cid: self._signals_of_set(set_cid, load_signals(set_cid), True))
+        for set_cid, signals in data.items():
+            self.add_signal_set(set_cid, signals, set_cid in complete_signal_sets)
+
+    def _signals_of_set(self, set_cid, signals, complete):
+        return SignalsOfSet(signals, complete, lambda: self._load_signals(set_cid))
+
+    def add_signal_set(self, set_cid, signals, complete):
+        """Add known signals of a signal set, complete tells whether these are all of its signals."""
+        self[set_cid] = self._signals_of_set(set_cid, signals, complete)
+
+
+def create_entities(data, complete_signal_sets, load_signal_set, load_signals):
+    """
+    Entities of a job, only the entities sent with the job are available immediately, the rest is loaded on demand.
+
+    :param data: entities sent with the job, dictionary with 'signalSets' and 'signals'
+    :param complete_signal_sets: cids of signal sets whose all signals are in data
+    :param load_signal_set: function returning signal set by its cid, raises KeyError if it does not exist
+    :param load_signals: function returning all signals of signal set by its cid, raises KeyError if the set does not exist
+    """
+    return {
+        'signalSets': LazyMapping(data.get('signalSets', {}), load_signal_set),
+        'signals': SignalsBySet(data.get('signals', {}), set(complete_signal_sets), load_signals),
+    }
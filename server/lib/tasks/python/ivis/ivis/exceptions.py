@@ -9,3 +9,7 @@ class RequestException(IvisException):
 
 class TimeoutException(IvisException):
     """Exception raised when there is timeout on input reading."""
+
+
+class CancelledException(IvisException):
+    """Exception raised when the server requested cancellation of the run."""
@@ -0,0 +1,196 @@
+"""
+Export of signal sets into columnar files uploaded as job files.
+
+Records are streamed from Elasticsearch and written in row groups of bounded size, so memory use does not depend
+on the size of the signal set. Requires pyarrow, which is an optional dependency of this package.
+"""
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from elasticsearch import helpers as es_helpers
+
+from .exceptions import IvisException
+from .helpers import ivis
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARQUET = 'parquet'
+ARROW = 'arrow'
+
+FORMATS = (PARQUET, ARROW)
+EXTENSIONS = {
+    PARQUET: 'parquet',
+    ARROW: 'arrow'
+}
+
+DEFAULT_ROW_GROUP_SIZE = 100000
+
+# Column holding the id of the record
+ID_COLUMN = 'id'
+
+
+def _get_arrow_type(signal_type):
+    return {
+        'integer': pa.int32(),
+        'long': pa.int64(),
+        'float': pa.float32(),
+        'double': pa.float64(),
+        'boolean': pa.bool_(),
+        'date': pa.timestamp('ms', tz='UTC'),
+    }.get(signal_type, pa.string())
+
+
+def _to_string(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _as_range_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class _Column:
+    def __init__(self, signal):
+        self.name = signal['cid']
+        self.field = signal['field']
+        self.type = _get_arrow_type(signal['type'])
+        # Dates are read as epoch milliseconds from doc values, whatever format they were stored in
+        self.is_date = signal['type'] == 'date'
+        self.is_string = self.type == pa.string()
+        self.values = []
+
+    def append(self, hit):
+        if self.is_date:
+            values = hit.get('fields', {}).get(self.field)
+            self.values.append(int(float(values[0])) if values else None)
+        else:
+            value = hit['_source'].get(self.field)
+            self.values.append(_to_string(value) if self.is_string else value)
+
+    def take(self):
+        array = pa.array(self.values, type=self.type)
+        self.values = []
+        return array
+
+
+class _Writer:
+    def __init__(self, path, format, schema):
+        self.format = format
+        if format == PARQUET:
+            self.writer = pq.ParquetWriter(path, schema)
+        else:
+            self.sink = pa.OSFile(path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, schema)
+
+    def write(self, batch):
+        if self.format == PARQUET:
+            # Each batch is one row group
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        if self.format == ARROW:
+            self.sink.close()
+
+
+def _write(path, signal_set_cid, signal_cids, ts_cid, start, end, format, row_group_size):
+    signal_set = ivis.entities['signalSets'][signal_set_cid]
+    set_signals = ivis.entities['signals'][signal_set_cid]
+    if signal_cids is None:
+        signal_cids = [cid for cid in set_signals if cid != ID_COLUMN]
+
+    columns = [_Column(set_signals[cid]) for cid in signal_cids]
+    schema = pa.schema([pa.field(ID_COLUMN, pa.string())] + [pa.field(column.name, column.type) for column in columns])
+
+    query = {
+        '_source': [column.field for column in columns if not column.is_date],
+        'docvalue_fields': [{'field': column.field, 'format': 'epoch_millis'} for column in columns if column.is_date],
+        'query': {'match_all': {}}
+    }
+
+    if ts_cid is not None:
+        ts_field = set_signals[ts_cid]['field']
+        query['sort'] = [{ts_field: 'asc'}]
+
+        time_range = {}
+        if start is not None:
+            time_range['gte'] = _as_range_value(start)
+        if end is not None:
+            time_range['lt'] = _as_range_value(end)
+        if time_range:
+            query['query'] = {'range': {ts_field: time_range}}
+    elif start is not None or end is not None:
+        raise ValueError('Timestamp signal has to be given to export a time range')
+
+    writer = _Writer(path, format, schema)
+    ids = []
+    rows = 0
+
+    def write_batch():
+        arrays = [pa.array(ids, type=pa.string())] + [column.take() for column in columns]
+        writer.write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        ids.clear()
+        ivis.report_progress(rows)
+        ivis.check_cancelled()
+
+    try:
+        for hit in es_helpers.scan(ivis.elasticsearch, index=signal_set['index'], query=query,
+                                   preserve_order=ts_cid is not None, scroll='5m', size=10000):
+            ids.append(hit['_id'])
+            for column in columns:
+                column.append(hit)
+            rows += 1
+
+            if len(ids) == row_group_size:
+                write_batch()
+
+        if ids or rows == 0:
+            write_batch()
+    finally:
+        writer.close()
+
+    return rows
+
+
+def export_signal_set(signal_set_cid, signal_cids=None, ts_cid=None, start=None, end=None, format=PARQUET,
+                      path=None, row_group_size=DEFAULT_ROW_GROUP_SIZE, upload=True):
+    """
+    Write signals of a signal set into a Parquet or Arrow IPC file and upload it as a file of the job.
+
+    :param signal_set_cid: cid of the signal set to export
+    :param signal_cids: cids of the signals to export, all signals when None
+    :param ts_cid: cid of the timestamp signal, records are sorted by it and start and end apply to it
+    :param start: start of the exported time range (inclusive), datetime, epoch milliseconds or Elasticsearch date
+    :param end: end of the exported time range (exclusive)
+    :param format: 'parquet' or 'arrow' (Arrow IPC file)
+    :param path: where to write the file, a temporary file named after the signal set is used and removed when None
+    :param row_group_size: maximal number of records in a row group (record batch for Arrow), bounds the memory used
+    :param upload: whether to upload the file as a job file
+    :return: number of exported records
+    """
+    if pa is None:
+        raise IvisException('Export requires pyarrow to be installed')
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format '{format}'")
+
+    def write_and_upload(file_path):
+        rows = _write(file_path, signal_set_cid, signal_cids, ts_cid, start, end, format, row_group_size)
+        if upload:
+            with open(file_path, 'rb') as file:
+                ivis.upload_file(file).raise_for_status()
+        return rows
+
+    if path is not None:
+        return write_and_upload(path)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return write_and_upload(os.path.join(tmp_dir, f'{signal_set_cid}.{EXTENSIONS[format]}'))
@@ -1,34 +1,111 @@
 import json
 import os
+import queue
 import sys
+import threading
+import time
+from datetime import datetime, timezone
 import requests
 
+from .entities import create_entities
 from .exceptions import *
 
 from elasticsearch import Elasticsearch
 
+try:
+    # Considerably faster on the large init message, optional
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 
 class Ivis:
     """Helper class for ivis tasks"""
 
+    # Minimal time in seconds between two progress messages sent to the server
+    HEARTBEAT_INTERVAL = 5
+
+    # Suffixes of partition indices of partitioned signal sets, have to match the server side formats
+    PARTITION_FORMATS = {
+        'year': '%Y',
+        'month': '%Y.%m',
+        'day': '%Y.%m.%d'
+    }
+
     def __init__(self):
-        self._data = json.loads(sys.stdin.readline())
+        self._data = json_loads(sys.stdin.readline())
         self._elasticsearch = Elasticsearch([{'host': self._data['es']['host'], 'port': int(self._data['es']['port'])}])
         self.state = self._data.get('state')
         self.params = self._data['params']
-        self.entities = self._data['entities']
         self.owned = self._data['owned']
         self._accessToken = self._data['accessToken']
         self._jobId = self._data['context']['jobId']
         self._sandboxUrlBase = self._data['server']['sandboxUrlBase']
 
+        # Timeout in seconds for responses from the server, None waits indefinitely
+        self.request_timeout = None
+
+        # Only entities referenced by params and owned ones are sent with the job, others are requested on first access
+        self.entities = create_entities(self._data['entities'], self._data.get('completeSignalSets', []),
+                                        self._get_signal_set_entity, self._get_signal_entities)
+
+        self._last_request_id = 0
+        self._last_heartbeat = None
+        self._responses = queue.Queue()
+        self._cancelled = threading.Event()
+        self._reader = threading.Thread(target=self._read_messages, daemon=True)
+        self._reader.start()
+
     @property
     def elasticsearch(self):
         return self._elasticsearch
 
-    @staticmethod
-    def _get_response_message():
-        msg = json.loads(sys.stdin.readline())
+    @property
+    def cancelled(self):
+        """True once the server asked the run to stop. Cheap enough to be checked in hot loops."""
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        """Raise CancelledException if the server asked the run to stop."""
+        if self._cancelled.is_set():
+            raise CancelledException('Run cancelled by the server')
+
+    def _read_messages(self):
+        # Server messages are read in the background so that cancellation is noticed even
+        # when the task is not waiting for a response
+        for line in sys.stdin:
+            msg = json_loads(line)
+            if msg.get('type') == 'cancel':
+                self._cancelled.set()
+            else:
+                self._responses.put(msg)
+
+        self._responses.put(None)
+
+    def _get_response_message(self, request_id, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                msg = self._responses.get(timeout=remaining)
+            except queue.Empty:
+                raise TimeoutException(f'No response to request {request_id} in {timeout} seconds')
+
+            if msg is None:
+                # Keep the closed channel visible to any following request
+                self._responses.put(None)
+                raise RequestException('Connection to the server closed')
+
+            # Errors of requests the server could not parse carry no id, they answer the pending request
+            if 'id' not in msg:
+                break
+
+            # Responses to requests that already timed out are dropped
+            if msg['id'] == request_id:
+                # Id only pairs the response with the request, it is not part of the response data
+                del msg['id']
+                break
+
         error = msg.get('error')
         if error:
             raise RequestException(error)
@@ -38,7 +115,66 @@ class Ivis:
     def _send_request_message(msg):
         os.write(3, (json.dumps(msg) + '\n').encode())
 
-    def create_signals(self, signal_sets=None, signals=None):
+    def _request(self, msg, timeout=None):
+        self._last_request_id += 1
+        msg['id'] = self._last_request_id
+        Ivis._send_request_message(msg)
+        return self._get_response_message(msg['id'], self.request_timeout if timeout is None else timeout)
+
+    def report_progress(self, processed, total=None, force=False):
+        """
+        Send heartbeat with the number of processed records to the server.
+        Messages are throttled to one per HEARTBEAT_INTERVAL unless force is set, so this can be called on every record.
+        """
+        now = time.monotonic()
+        if not force and self._last_heartbeat is not None and now - self._last_heartbeat < Ivis.HEARTBEAT_INTERVAL:
+            return
+
+        self._last_heartbeat = now
+        msg = {
+            'type': 'progress',
+            'processed': processed
+        }
+        if total is not None:
+            msg['total'] = total
+
+        Ivis._send_request_message(msg)
+
+    def _get_signal_set_entity(self, signal_set_cid):
+        response = self._request({
+            'type': 'get_entities',
+            'signalSets': [signal_set_cid]
+        })
+        return response['signalSets'][signal_set_cid]
+
+    def _get_signal_entities(self, signal_set_cid):
+        response = self._request({
+            'type': 'get_entities',
+            'signals': {signal_set_cid: None}
+        })
+        return response['signals'][signal_set_cid]
+
+    def get_signal_sets_in_namespace(self, namespace, include_signals=False, timeout=None):
+        """
+        Signal sets in the namespace by their cid, all fetched at once and added to entities.
+        With include_signals all their signals are added to entities in the same request.
+        """
+        response = self._request({
+            'type': 'get_entities',
+            'namespace': namespace,
+            'includeSignals': include_signals
+        }, timeout)
+
+        for sig_set_cid, signal_set in response['signalSets'].items():
+            if not self.entities['signalSets'].is_loaded(sig_set_cid):
+                self.entities['signalSets'][sig_set_cid] = signal_set
+        for sig_set_cid, signals in response['signals'].items():
+            if not self.entities['signals'].is_loaded(sig_set_cid):
+                self.entities['signals'].add_signal_set(sig_set_cid, signals, True)
+
+        return response['signalSets']
+
+    def create_signals(self, signal_sets=None, signals=None, timeout=None):
         msg = {
             'type': 'create_signals',
         }
@@ -49,29 +185,38 @@ class Ivis:
         if signals is not None:
             msg['signals'] = signals
 
-        Ivis._send_request_message(msg)
-        response = Ivis._get_response_message()
+        response = self._request(msg, timeout)
 
         # Add newly created to owned
         for sig_set_cid, set_props in response.items():
             signals_created = set_props.get('signals', {})
+            set_created = False
             if signal_sets is not None:
                 # Function allows passing in either array of signal sets or one signal set
                 if (isinstance(signal_sets, list) and any(map(lambda s: s["cid"] == sig_set_cid, signal_sets))) or (
                         not isinstance(signal_sets, list) and signal_sets["cid"] == sig_set_cid):
                     self.owned.setdefault('signalSets', {}).setdefault(sig_set_cid, {})
+                    set_created = True
             setEntity = dict(set_props)
             setEntity.pop('signals', None) # Don't belong to entities
-            self.entities['signalSets'].setdefault(sig_set_cid, setEntity)
+            # Entities are filled in directly, lookups through them would request missing ones from the server
+            if not self.entities['signalSets'].is_loaded(sig_set_cid):
+                self.entities['signalSets'][sig_set_cid] = setEntity
             if signals_created:
                 self.owned.setdefault('signals', {}).setdefault(sig_set_cid, {})
+                if not self.entities['signals'].is_loaded(sig_set_cid):
+                    # A newly created set has no other signals than those in the response
+                    self.entities['signals'].add_signal_set(sig_set_cid, {}, set_created)
+                set_signals = self.entities['signals'][sig_set_cid]
                 for sigCid, sig_props in signals_created.items():
                     self.owned['signals'][sig_set_cid].setdefault(sigCid, {})
-                    self.entities['signals'].setdefault(sig_set_cid, {}).setdefault(sigCid, sig_props)
+                    if not set_signals.is_loaded(sigCid):
+                        set_signals[sigCid] = sig_props
 
         return response
 
-    def create_signal_set(self, cid, namespace, name=None, description=None, record_id_template=None, signals=None):
+    def create_signal_set(self, cid, namespace, name=None, description=None, record_id_template=None, signals=None,
+                          settings=None):
 
         signal_set = {
             "cid": cid,
@@ -86,9 +231,29 @@ class Ivis:
             signal_set["record_id_template"] = record_id_template
         if signals is not None:
             signal_set['signals'] = signals
+        if settings is not None:
+            signal_set['settings'] = settings
 
         return self.create_signals(signal_sets=signal_set)
 
+    def get_partition_index(self, signal_set_cid, timestamp):
+        """
+        Index to write the record with given timestamp (datetime or epoch milliseconds) of the signal set into.
+        Partitioned signal sets are stored in an index per time period, their index is only an alias for reading.
+        """
+        signal_set = self.entities['signalSets'][signal_set_cid]
+        partitioning = signal_set.get('partitioning')
+        if partitioning is None:
+            return signal_set['index']
+
+        if isinstance(timestamp, datetime):
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone(timezone.utc)
+        else:
+            timestamp = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+
+        return f"{signal_set['index']}-{timestamp.strftime(Ivis.PARTITION_FORMATS[partitioning])}"
+
     def create_signal(self, signal_set_cid, cid, namespace, type, name=None, description=None, indexed=None,
                       settings=None,
                       weight_list=None, weight_edit=None, **extra_keys):
@@ -121,19 +286,35 @@ class Ivis:
 
         return self.create_signals(signals=signals)
 
-    @staticmethod
-    def store_state(state):
+    def store_state(self, state, timeout=None):
         msg = {
             "type": "store_state",
             "state": state
         }
 
-        Ivis._send_request_message(msg)
-        return Ivis._get_response_message()
+        return self._request(msg, timeout)
+
+    def remove_records(self, signal_set_cid, ts_cid, end, requests_per_second=None, timeout=None):
+        """
+        Remove records of the signal set with timestamp before end (epoch milliseconds) on the server.
+        Records of non-computed signal sets are removed from their storage as well, not only from the index.
+        Requires the owner of the job to be allowed to delete records of the set. Returns the number of removed records.
+        """
+        msg = {
+            'type': 'remove_records',
+            'signalSet': signal_set_cid,
+            'ts': ts_cid,
+            'end': end
+        }
+        if requests_per_second is not None:
+            msg['requestsPerSecond'] = requests_per_second
+
+        return self._request(msg, timeout)['removed']
 
     def upload_file(self, file):
         url = f"{self._sandboxUrlBase}/{self._accessToken}/rest/files/job/file/{self._jobId}/"
         response = requests.post(url, files = {"files[]": file})
+        return response
 
     def get_job_file(self, id):
         return requests.get(f"{self._sandboxUrlBase}/{self._accessToken}/rest/files/job/file/{id}")
@@ -20,4 +20,8 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     python_requires='>=3.6',
+    extras_require={
+        'fast': ['orjson'],
+        'export': ['pyarrow'],
+    },
 )
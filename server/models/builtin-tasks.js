@@ -4,7 +4,7 @@ const knex = require('../lib/knex');
 const path = require('path');
 const fs = require('fs-extra-promise');
 const {getVirtualNamespaceId} = require("../../shared/namespaces");
-const {BuiltinTaskNames, TaskSource, BuildState, TaskType, PYTHON_BUILTIN_CODE_FILE_NAME, PYTHON_BUILTIN_PARAMS_FILE_NAME} = require("../../shared/tasks");
+const {BuiltinTaskNames, TaskSource, BuildState, TaskType, PythonSubtypes, PYTHON_BUILTIN_CODE_FILE_NAME, PYTHON_BUILTIN_PARAMS_FILE_NAME} = require("../../shared/tasks");
 const em = require('../lib/extension-manager');
 
 // code is loaded from file
@@ -20,13 +20,42 @@ const aggregationTask = {
             "type": "signalSet",
             "label": "Signal Set",
             "help": "Signal set to aggregate",
-            "includeSignals": true
+            "includeSignals": true,
+            "cardinality": "0..1"
         }, {
             "id": "ts",
             "type": "signal",
             "signalSetRef": "signalSet",
             "label": "Timestamp signal",
-            "help": "Timestamp for aggregation"
+            "help": "Timestamp for aggregation",
+            "cardinality": "0..1"
+        }, {
+            "id": "sets",
+            "type": "fieldset",
+            "label": "Signal sets",
+            "help": "Further signal sets aggregated by the same job",
+            "cardinality": "0..n",
+            "children": [{
+                "id": "signalSet",
+                "type": "signalSet",
+                "label": "Signal Set",
+                "includeSignals": true
+            }, {
+                "id": "ts",
+                "type": "signal",
+                "signalSetRef": "signalSet",
+                "label": "Timestamp signal"
+            }]
+        }, {
+            "id": "namespace",
+            "type": "integer",
+            "label": "Namespace",
+            "help": "Id of namespace whose signal sets are all aggregated, computed signal sets excluded"
+        }, {
+            "id": "tsSignal",
+            "type": "string",
+            "label": "Timestamp signal of namespace",
+            "help": "Cid of the timestamp signal of the signal sets in the namespace, sets without it are skipped"
         }, {
             "id": "offset",
             "type": "string",
@@ -37,6 +66,11 @@ const aggregationTask = {
             "type": "string",
             "label": "Interval",
             "help": "Bucket interval"
+        }, {
+            "id": "partitioning",
+            "type": "string",
+            "label": "Partitioning",
+            "help": "Time period of the indices the aggregation is stored in (year, month or day), empty for a single index"
         }],
     },
 };
@@ -47,6 +81,8 @@ const flattenTask = {
     type: TaskType.PYTHON,
     settings: {
         builtin_reinitOnUpdate: true,
+        // Alignment of the sets is done in numpy
+        subtype: PythonSubtypes.NUMPY,
         params: [
             {
                 "id": "resolutionMethod",
@@ -92,10 +128,41 @@ const flattenTask = {
                         "type": "signal",
                         "label": "Signals",
                         "cardinality": "1..n",
-                        "signalSetRef": "cid"
+                        "signalSetRef": "cid",
+                        "signalType": ["integer", "long", "float", "double"]
+                    }
+                ]
+            },
+            {
+                "id": "fillMethod",
+                "type": "option",
+                "label": "Fill method",
+                "help": "How values of a signal set are taken at time points of the other sets",
+                "options": [
+                    {
+                        "key": "aggregate",
+                        "label": "Records within tolerance, combined with the resolution method"
+                    },
+                    {
+                        "key": "previous",
+                        "label": "Previous value"
+                    },
+                    {
+                        "key": "nearest",
+                        "label": "Nearest value"
+                    },
+                    {
+                        "key": "linear",
+                        "label": "Linear interpolation"
                     }
                 ]
             },
+            {
+                "id": "tolerance",
+                "type": "string",
+                "label": "Tolerance",
+                "help": "E.g. 500ms or 30s. Maximal distance of the used record, the maximal gap to interpolate over for linear interpolation. Only records at the same time point are combined if not set with the aggregate method, any distance is accepted with the others. Nearest and linear values after a signal without a record for twice its usual gap are not updated once its records resume"
+            },
             {
                 "id": "signalSet",
                 "label": "New signal set properties",
@@ -131,12 +198,98 @@ const flattenTask = {
     },
 };
 
+const retentionTask = {
+    name: BuiltinTaskNames.RETENTION,
+    description: 'Task removing raw data of a signal set older than the given age once they are aggregated',
+    type: TaskType.PYTHON,
+    settings: {
+        builtin_reinitOnUpdate: true,
+        params: [{
+            "id": "signalSet",
+            "type": "signalSet",
+            "label": "Signal Set",
+            "help": "Signal set to remove old data from"
+        }, {
+            "id": "ts",
+            "type": "signal",
+            "signalSetRef": "signalSet",
+            "label": "Timestamp signal",
+            "help": "Timestamp the age of the data is determined by"
+        }, {
+            "id": "interval",
+            "type": "string",
+            "label": "Interval",
+            "help": "Bucket interval of the aggregation that has to exist for the removed data"
+        }, {
+            "id": "age",
+            "type": "string",
+            "label": "Age",
+            "help": "Data older than this are removed, e.g. 90d"
+        }, {
+            "id": "batchSize",
+            "type": "integer",
+            "label": "Batch size",
+            "help": "Number of buckets removed at once, 1000 if not set"
+        }, {
+            "id": "requestsPerSecond",
+            "type": "float",
+            "label": "Requests per second",
+            "help": "Throttling of the removal in records per second, unlimited if not set"
+        }],
+    },
+};
+
+const downsamplingTask = {
+    name: BuiltinTaskNames.DOWNSAMPLING,
+    description: 'Task maintaining downsampled series of numeric signals of a signal set at several resolutions',
+    type: TaskType.PYTHON,
+    settings: {
+        builtin_reinitOnUpdate: true,
+        subtype: PythonSubtypes.NUMPY,
+        params: [{
+            "id": "signalSet",
+            "type": "signalSet",
+            "label": "Signal Set",
+            "help": "Signal set to downsample",
+            "includeSignals": true
+        }, {
+            "id": "ts",
+            "type": "signal",
+            "signalSetRef": "signalSet",
+            "label": "Timestamp signal",
+            "help": "Timestamp for downsampling"
+        }, {
+            "id": "method",
+            "type": "option",
+            "label": "Method",
+            "help": "Selection of the representative points of a bucket",
+            "options": [
+                {
+                    "key": "lttb",
+                    "label": "Largest triangle three buckets"
+                },
+                {
+                    "key": "minmax",
+                    "label": "Minimum and maximum"
+                }
+            ]
+        }, {
+            "id": "resolutions",
+            "type": "string",
+            "label": "Resolutions",
+            "help": "Comma separated bucket widths, e.g. 1m,1h,1d, each is stored in its own signal set"
+        }],
+    },
+};
+
 /**
  * All default builtin tasks
  */
 const builtinTasks = [
     aggregationTask,
     flattenTask,
+    retentionTask,
+    downsamplingTask,
 ];
 
 em.on('builtinTasks.add', addTasks);
@@ -12,6 +12,8 @@ const dtHelpers = require('../lib/dt-helpers');
 const jobs = require('./jobs');
 const interoperableErrors = require('../../shared/interoperable-errors');
 const {isSignalSetAggregationIntervalValid} = require('../../shared/validators');
+const {SignalSetPartitioning, SignalSetType} = require('../../shared/signal-sets');
+const shares = require('./shares');
 const moment = require('moment');
 
 async function listDTAjax(context, sigSetId, params) {
@@ -23,8 +25,7 @@ async function listDTAjax(context, sigSetId, params) {
             .innerJoin('jobs', function () {
                 this.on('aggregation_jobs.job', '=', 'jobs.id').andOn('aggregation_jobs.set', '=', sigSetId);
             })
-            .leftJoin('signal_sets_owners', 'signal_sets_owners.job', 'jobs.id')
-            .leftJoin('signal_sets', 'signal_sets.id', 'signal_sets_owners.set'),
+            .leftJoin('signal_sets', 'signal_sets.id', 'aggregation_jobs.agg_set'),
         ['signal_sets.id', 'signal_sets.cid', 'signal_sets.name', 'signal_sets.description', 'signal_sets.state', 'signal_sets.created', 'jobs.id', 'jobs.params'],
         {
             mapFun: data => {
@@ -51,9 +52,8 @@ async function getMaxFittingAggSet(sigSetId, maxInterval, dateFrom) {
                     }
             }
         )
-        .innerJoin('jobs', 'aggregation_jobs.job', 'jobs.id')
-        .innerJoin('signal_sets_owners', 'signal_sets_owners.job', 'jobs.id')
-        .innerJoin('signal_sets', 'signal_sets.id', 'signal_sets_owners.set')
+        // The job may aggregate other signal sets as well, only the aggregation of this one is used
+        .innerJoin('signal_sets', 'signal_sets.id', 'aggregation_jobs.agg_set')
         .orderBy('interval', 'desc')
         .first();
     if (sigSet) {
@@ -66,8 +66,7 @@ async function listSetAggs(sigSetId) {
     const setAggs = await knex('aggregation_jobs')
         .where('aggregation_jobs.set', sigSetId)
         .innerJoin('jobs', 'aggregation_jobs.job', 'jobs.id')
-        .innerJoin('signal_sets_owners', 'signal_sets_owners.job', 'jobs.id')
-        .innerJoin('signal_sets', 'signal_sets.id', 'signal_sets_owners.set');
+        .innerJoin('signal_sets', 'signal_sets.id', 'aggregation_jobs.agg_set');
     setAggs.forEach(parseParams);
     return setAggs;
 
@@ -83,6 +82,57 @@ function intervalStrToMiliseconds(intervalStr) {
 }
 
 
+/**
+ * Register signal set created by an aggregation job as the aggregation of its source signal set, so that queries
+ * of the source signal set are substituted by it. Other signal sets are ignored.
+ * @param tx
+ * @param jobId Job that created the signal set
+ * @param aggSet Created signal set
+ * @returns {Promise<void>}
+ */
+async function registerAggSetTx(tx, jobId, aggSet) {
+    const task = await getBuiltinTask(BuiltinTaskNames.AGGREGATION);
+    const job = await tx('jobs').where('id', jobId).first();
+    if (!task || !job || job.task !== task.id) {
+        return;
+    }
+
+    const params = JSON.parse(job.params);
+    const prefix = `aggregation_${params.interval}_`;
+    if (!aggSet.cid.startsWith(prefix)) {
+        return;
+    }
+
+    const signalSet = await tx('signal_sets').where('cid', aggSet.cid.slice(prefix.length)).first();
+    if (!signalSet) {
+        return;
+    }
+
+    // Set aggregated by the signalSet param is registered when the aggregation is created
+    const existing = await tx('aggregation_jobs').where({set: signalSet.id, job: jobId}).first();
+    if (existing) {
+        await tx('aggregation_jobs').where({set: signalSet.id, job: jobId}).update({agg_set: aggSet.id});
+    } else {
+        await tx('aggregation_jobs').insert({
+            set: signalSet.id,
+            job: jobId,
+            offset: params.offset || null,
+            interval: intervalStrToMiliseconds(params.interval),
+            agg_set: aggSet.id
+        });
+    }
+}
+
+/**
+ * Create aggregation job of a signal set
+ * @param tx
+ * @param context
+ * @param sigSetId
+ * @param params interval, ts, offset and partitioning of the aggregation, optionally sets (list of {signalSet, ts}
+ * with cids of other signal sets and their timestamp signals) and namespace with tsSignal to aggregate other
+ * signal sets by the same job
+ * @returns {Promise<number>} id of the created job
+ */
 async function createTx(tx, context, sigSetId, params) {
     const intervalStr = params.interval;
     const ts = params.ts;
@@ -93,7 +143,7 @@ async function createTx(tx, context, sigSetId, params) {
     const task = await getBuiltinTask(BuiltinTaskNames.AGGREGATION);
     enforce(task, `Aggregation task not found`);
 
-    const tsExists = tx('signals').where({set: sigSetId, cid: ts}).first();
+    const tsExists = await tx('signals').where({set: sigSetId, cid: ts}).first();
     enforce(tsExists, `Timestamp signal not found in ${sigSetId}`);
 
     enforce(isSignalSetAggregationIntervalValid(intervalStr), 'Interval must be a positive integer and have a unit.');
@@ -103,19 +153,65 @@ async function createTx(tx, context, sigSetId, params) {
         enforce(date && date.isValid(), 'Offset is not in valid format');
     }
 
+    if (params.partitioning != null) {
+        enforce(Object.values(SignalSetPartitioning).includes(params.partitioning), 'Unknown partitioning');
+    }
+
     const jobParams = {
         signalSet: signalSet.cid,
         offset: params.offset,
         ts: ts,
-        interval: intervalStr
+        interval: intervalStr,
+        partitioning: params.partitioning
     };
 
     const intervalms = intervalStrToMiliseconds(intervalStr);
     const aggregationJobName = `aggregation_${intervalStr}_${signalSet.cid}`;
 
-    const exists = await tx('aggregation_jobs').where('interval', intervalms).first();
-    if (exists) {
-        throw new interoperableErrors.ServerValidationError(`Aggregation for given interval '${intervalStr}' already exists.`);
+    // Other signal sets may be aggregated by the same job, either listed with their timestamp signals
+    // or all signal sets of a namespace which have the given timestamp signal
+    const aggregatedSets = [signalSet];
+    if (params.sets != null) {
+        enforce(Array.isArray(params.sets), 'Signal sets must be a list');
+        jobParams.sets = [];
+        for (const entry of params.sets) {
+            const otherSet = await tx('signal_sets').where('cid', entry.signalSet).first();
+            enforce(otherSet, `Signal set ${entry.signalSet} not found`);
+            await shares.enforceEntityPermissionTx(tx, context, 'signalSet', otherSet.id, 'query');
+            const otherTs = await tx('signals').where({set: otherSet.id, cid: entry.ts}).first();
+            enforce(otherTs, `Timestamp signal not found in ${otherSet.cid}`);
+
+            jobParams.sets.push({signalSet: otherSet.cid, ts: otherTs.cid});
+            aggregatedSets.push(otherSet);
+        }
+    }
+
+    const triggerSetIds = aggregatedSets.map(set => set.id);
+    if (params.namespace != null) {
+        enforce(params.tsSignal, 'Timestamp signal of the signal sets of the namespace must be specified');
+        await shares.enforceEntityPermissionTx(tx, context, 'namespace', params.namespace, 'view');
+        jobParams.namespace = params.namespace;
+        jobParams.tsSignal = params.tsSignal;
+
+        // Signal sets of the namespace are registered as the job creates their aggregations, they trigger it already
+        const namespaceSets = await tx('signal_sets')
+            .select('signal_sets.id')
+            .innerJoin('signals', 'signals.set', 'signal_sets.id')
+            .where('signal_sets.namespace', params.namespace)
+            .whereNot('signal_sets.type', SignalSetType.COMPUTED)
+            .where('signals.cid', params.tsSignal);
+        for (const namespaceSet of namespaceSets) {
+            if (!triggerSetIds.includes(namespaceSet.id)) {
+                triggerSetIds.push(namespaceSet.id);
+            }
+        }
+    }
+
+    for (const aggregatedSet of aggregatedSets) {
+        const exists = await tx('aggregation_jobs').where({set: aggregatedSet.id, interval: intervalms}).first();
+        if (exists) {
+            throw new interoperableErrors.ServerValidationError(`Aggregation of signal set '${aggregatedSet.cid}' for given interval '${intervalStr}' already exists.`);
+        }
     }
 
     const job = {
@@ -125,14 +221,16 @@ async function createTx(tx, context, sigSetId, params) {
         task: task.id,
         state: JobState.ENABLED,
         params: jobParams,
-        signal_sets_triggers: [sigSetId],
+        signal_sets_triggers: triggerSetIds,
         trigger: null,
         min_gap: null,
         delay: null
     };
     const jobId = await jobs.create(context, job, true);
 
-    await tx('aggregation_jobs').insert({job: jobId, set: signalSet.id, offset: params.offset, interval: intervalms});
+    for (const aggregatedSet of aggregatedSets) {
+        await tx('aggregation_jobs').insert({job: jobId, set: aggregatedSet.id, offset: params.offset, interval: intervalms});
+    }
 
     jobs.run(context, jobId).catch(error => log.error('signal-set-aggregations', error));
 
@@ -150,6 +248,7 @@ module.exports.createTx = createTx;
 module.exports.listDTAjax = listDTAjax;
 module.exports.listSetAggs = listSetAggs;
 module.exports.getMaxFittingAggSet = getMaxFittingAggSet;
+module.exports.registerAggSetTx = registerAggSetTx;
 
 
 
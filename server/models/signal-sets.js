@@ -454,6 +454,29 @@ async function removeRecord(context, sigSet, recordId) {
     await signalStorage.removeRecord(sigSet, recordId);
 }
 
+/**
+ * Remove records with timestamp before the given end, used to remove old raw data
+ * @param context
+ * @param sigSetWithSigMap
+ * @param tsCid Cid of the timestamp signal
+ * @param end Epoch milliseconds, records before it are removed
+ * @param requestsPerSecond Throttling of the removal from the index in records per second, unlimited if not set
+ * @returns {Promise<{removed: number}>}
+ */
+async function removeRecordsBefore(context, sigSetWithSigMap, tsCid, end, requestsPerSecond) {
+    await shares.enforceEntityPermission(context, 'signalSet', sigSetWithSigMap.id, 'deleteRecord');
+
+    const tsSignal = sigSetWithSigMap.signalByCidMap[tsCid];
+    enforce(tsSignal && tsSignal.type === SignalType.DATE_TIME, `Timestamp signal "${tsCid}" not found`);
+
+    if (sigSetWithSigMap.type === SignalSetType.COMPUTED) {
+        // Records of computed signal sets are only in the index
+        return await indexer.onRemoveRecordsBefore(sigSetWithSigMap, tsCid, end, requestsPerSecond);
+    } else {
+        return await signalStorage.removeRecordsBefore(sigSetWithSigMap, tsCid, end, requestsPerSecond);
+    }
+}
+
 
 async function serverValidateRecord(context, sigSetId, data) {
     const result = {};
@@ -876,6 +899,7 @@ module.exports.getRecord = getRecord;
 module.exports.insertRecords = insertRecords;
 module.exports.updateRecord = updateRecord;
 module.exports.removeRecord = removeRecord;
+module.exports.removeRecordsBefore = removeRecordsBefore;
 module.exports.serverValidateRecord = serverValidateRecord;
 module.exports.index = index;
 module.exports.query = query;
@@ -190,6 +190,18 @@ async function removeRecord(sigSet, recordId) {
     await signalSets.dataModified(sigSet.id);
 }
 
+async function removeRecordsBefore(sigSetWithSigMap, tsCid, end, requestsPerSecond) {
+    const tsSignal = sigSetWithSigMap.signalByCidMap[tsCid];
+    const tblName = getTableName(sigSetWithSigMap);
+    const removed = await knex(tblName).where(getColumnName(tsSignal.id), '<', serializeToDb[SignalType.DATE_TIME](end)).del();
+
+    // Records are removed from the table first, so a failed removal from the index is not undone by reindexing
+    await indexer.onRemoveRecordsBefore(sigSetWithSigMap, tsCid, end, requestsPerSecond);
+    await signalSets.dataModified(sigSetWithSigMap.id);
+
+    return {removed};
+}
+
 async function idExists(sigSet, recordId, existingId) {
     const tblName = getTableName(sigSet);
     const qry = knex(tblName).where('id', recordId).select('id').first();
@@ -218,6 +230,7 @@ module.exports.getRecord = getRecord;
 module.exports.insertRecords = insertRecords;
 module.exports.updateRecord = updateRecord;
 module.exports.removeRecord = removeRecord;
+module.exports.removeRecordsBefore = removeRecordsBefore;
 module.exports.idExists = idExists;
 module.exports.getLastId = getLastId;
 module.exports.getTableName = getTableName;
@@ -3,6 +3,7 @@ const path = require('path');
 const fs = require('fs-extra-promise');
 const spawn = require('child_process').spawn;
 const {PythonSubtypes, defaultSubtypeKey, PYTHON_JOB_FILE_NAME: JOB_FILE_NAME} = require('../../../shared/tasks');
+const {JobMsgType} = require('../../../shared/jobs');
 const readline = require('readline');
 const ivisConfig = require('../../lib/config');
 const em = require('../../lib/extension-manager');
@@ -15,6 +16,9 @@ const IVIS_PCKG_DIR = path.join(__dirname, '..', '..', 'lib', 'tasks', 'python',
 
 const runningProc = new Map();
 
+// Time in seconds the job has to finish after it was asked to cancel, before it is interrupted
+const cancelGracePeriod = ivisConfig.tasks.python.cancelGracePeriod || 5;
+
 // const defaultPythonLibs = ivisConfig.tasks.python.defaultPythonLibs;
 const defaultPythonLibs = ['elasticsearch', 'requests'];
 const taskSubtypeSpecs = {
@@ -65,7 +69,10 @@ async function run({jobId, runId, taskDir, inputData}, onEvent, onSuccess, onFai
         jobOutStream.on('line', (input) => {
             onEvent('request', input)
                 .then(msg => {
-                    jobProc.stdin.write(JSON.stringify(msg) + '\n');
+                    // Some messages, like progress heartbeats, are not answered
+                    if (msg) {
+                        jobProc.stdin.write(JSON.stringify(msg) + '\n');
+                    }
                 })
                 .catch(err => {
                     errOutput += err;
@@ -108,6 +115,7 @@ async function run({jobId, runId, taskDir, inputData}, onEvent, onSuccess, onFai
 
         jobProc.on('exit', (code, signal) => {
             runningProc.delete(runId);
+            clearTimeout(jobProc.killTimer);
             if (code === 0) {
                 onSuccess(storeConfig);
             } else {
@@ -296,8 +304,14 @@ async function init(config, onSuccess, onFail) {
  */
 async function stop(runId) {
     const proc = runningProc.get(runId);
-    if (proc) {
-        proc.kill('SIGINT');
+    if (proc && !proc.killTimer) {
+        // Job gets a chance to finish cooperatively, it is interrupted only if it doesn't end in time
+        try {
+            proc.stdin.write(JSON.stringify({type: JobMsgType.CANCEL}) + '\n');
+        } catch (err) {
+            log.error(err);
+        }
+        proc.killTimer = setTimeout(() => proc.kill('SIGINT'), cancelGracePeriod * 1000);
     }
     // TODO check the possibilty of run being on event loop
     // meaning that there is no runningProc registered on that id, but the run is in wait
@@ -12,8 +12,11 @@ const {getSignalSetEntitySpec, allowedKeysCreate: allowedSignalSetKeysCreate} =
 const {getIndexName} = require('../../lib/indexers/elasticsearch-common');
 const {filterObject} = require('../../lib/helpers');
 const {getAdminContext} = require('../../lib/context-helpers');
+const {getEntityType} = require('../../lib/entity-settings');
 const createSigSet = require('../../models/signal-sets').createTx;
+const {getByCid: getSignalSetByCid, removeRecordsBefore} = require('../../models/signal-sets');
 const createSignal = require('../../models/signals').createTx;
+const {registerAggSetTx} = require('../../models/signal-set-aggregations');
 
 const {getSuccessEventType, getOutputEventType, EventTypes} = require('../../lib/task-events');
 
@@ -104,6 +107,7 @@ async function processCreateRequest(jobId, signalSets, signalsSpec) {
             }
         }
         await tx('signal_sets_owners').insert({job: jobId, set: filteredSignalSet.id});
+        await registerAggSetTx(tx, jobId, ceatedSignalSet);
 
         signalSetSpec['signals'] = createdSignalsSpecs;
         return signalSetSpec;
@@ -121,7 +125,117 @@ async function processCreateRequest(jobId, signalSets, signalsSpec) {
     }
 }
 
-async function handleRequest(jobId, requestStr) {
+/**
+ * Query of signal sets the job has access to, the ones its owner can view and the ones it owns
+ * @param jobId
+ * @param owner Id of the owner of the job
+ * @returns {QueryBuilder}
+ */
+function getJobVisibleSignalSetsQuery(jobId, owner) {
+    const permissionsTable = getEntityType('signalSet').permissionsTable;
+
+    return knex('signal_sets').where(function () {
+        this.whereIn('id', knex('signal_sets_owners').select('set').where('job', jobId));
+        if (owner != null) {
+            this.orWhereIn('id', knex(permissionsTable).select('entity').where({user: owner, operation: 'view'}));
+        }
+    });
+}
+
+/**
+ * Process request for entities not sent with the job
+ * @param jobId
+ * @param signalSetCids Cids of signal sets to get
+ * @param signalsSpec Object with signal set cids as keys and arrays of signal cids as values, null for all signals of the set
+ * @param namespace Id of namespace to get all signal sets of
+ * @param includeSignals Whether to get all signals of the signal sets of the namespace as well
+ * @returns {Promise<{signalSets: Object, signals: Object}>} Found entities, the ones not found or not accessible by the job are left out
+ */
+async function processEntitiesRequest(jobId, signalSetCids, signalsSpec, namespace, includeSignals) {
+    const entities = {
+        signalSets: {},
+        signals: {}
+    };
+
+    const job = await knex('jobs').select('owner').where('id', jobId).first();
+    const visibleSignalSets = () => getJobVisibleSignalSetsQuery(jobId, job && job.owner);
+
+    if (signalSetCids) {
+        const signalSets = await visibleSignalSets().whereIn('cid', signalSetCids);
+        for (const signalSet of signalSets) {
+            entities.signalSets[signalSet.cid] = getSignalSetEntitySpec(signalSet);
+        }
+    }
+
+    if (namespace != null) {
+        const signalSets = await visibleSignalSets().where('namespace', namespace);
+        const setCids = new Map();
+        for (const signalSet of signalSets) {
+            entities.signalSets[signalSet.cid] = getSignalSetEntitySpec(signalSet);
+            setCids.set(signalSet.id, signalSet.cid);
+            if (includeSignals) {
+                entities.signals[signalSet.cid] = {};
+            }
+        }
+
+        if (includeSignals && setCids.size > 0) {
+            const signals = await knex('signals').whereIn('set', [...setCids.keys()]);
+            for (const signal of signals) {
+                entities.signals[setCids.get(signal.set)][signal.cid] = getSignalEntitySpec(signal);
+            }
+        }
+    }
+
+    if (signalsSpec) {
+        for (const [sigSetCid, signalCids] of Object.entries(signalsSpec)) {
+            const sigSet = await visibleSignalSets().select('id').where('cid', sigSetCid).first();
+            if (!sigSet) {
+                continue;
+            }
+
+            const query = knex('signals').where('set', sigSet.id);
+            if (signalCids) {
+                query.whereIn('cid', signalCids);
+            }
+
+            const signals = {};
+            for (const signal of await query) {
+                signals[signal.cid] = getSignalEntitySpec(signal);
+            }
+            entities.signals[sigSetCid] = signals;
+        }
+    }
+
+    return entities;
+}
+
+/**
+ * Process request for removal of records of a signal set older than given time, with the permissions of the job owner
+ * @param jobId
+ * @param signalSetCid
+ * @param tsCid Cid of the timestamp signal
+ * @param end Epoch milliseconds, records before it are removed
+ * @param requestsPerSecond Throttling of the removal in records per second
+ * @returns {Promise<{removed: number}>}
+ */
+async function processRemoveRecordsRequest(jobId, signalSetCid, tsCid, end, requestsPerSecond) {
+    const job = await knex('jobs').select('owner').where('id', jobId).first();
+    if (!job || job.owner == null) {
+        throw new Error('Job without an owner cannot remove records');
+    }
+
+    // Just faking context here, the job acts on behalf of its owner
+    const context = {
+        user: {
+            id: job.owner
+        }
+    };
+
+    const sigSetWithSigMap = await getSignalSetByCid(context, signalSetCid, false, true);
+    return await removeRecordsBefore(context, sigSetWithSigMap, tsCid, end, requestsPerSecond);
+}
+
+async function handleRequest(jobId, requestStr, onProgress) {
     let response = {};
 
     if (!requestStr) {
@@ -171,6 +285,33 @@ async function handleRequest(jobId, requestStr) {
                     response.error(`${STATE_FIELD} not specified`)
                 }
                 break;
+            case JobMsgType.GET_ENTITIES:
+                if (request.signalSets || request.signals || request.namespace != null) {
+                    const reqResult = await processEntitiesRequest(jobId, request.signalSets, request.signals, request.namespace, request.includeSignals);
+                    response = {
+                        ...response,
+                        ...reqResult
+                    };
+                } else {
+                    response.error = `Either signalSets, signals or namespace have to be specified`;
+                }
+                break;
+            case JobMsgType.REMOVE_RECORDS:
+                if (request.signalSet && request.ts && request.end != null) {
+                    const reqResult = await processRemoveRecordsRequest(jobId, request.signalSet, request.ts, request.end, request.requestsPerSecond);
+                    response = {
+                        ...response,
+                        ...reqResult
+                    };
+                } else {
+                    response.error = `signalSet, ts and end have to be specified`;
+                }
+                break;
+            case JobMsgType.PROGRESS:
+                onProgress(request.processed, request.total);
+                // Heartbeats are not answered
+                response = null;
+                break;
             default:
                 response.error = `Type ${request.type} not recognized`;
                 break;
@@ -194,6 +335,11 @@ function createRunManager(jobId, runId, runOptions) {
     let accessTokenRefreshTimer;
     let accessToken = runOptions.config.inputData.accessToken;
 
+    // Watchdog is armed by the first heartbeat, so jobs that don't report progress are not affected
+    const heartbeatTimeout = config.tasks.heartbeatTimeout;
+    let heartbeatTimer;
+    let progress = null;
+
     if (accessToken) {
         refreshAccessToken().catch(
             e => log.error(e)
@@ -215,9 +361,25 @@ function createRunManager(jobId, runId, runOptions) {
         accessTokenRefreshTimer = setTimeout(refreshAccessToken, 30 * 1000);
     }
 
+    function onProgress(processed, total) {
+        progress = {processed, total};
+        if (heartbeatTimeout) {
+            clearTimeout(heartbeatTimer);
+            heartbeatTimer = setTimeout(onHeartbeatTimeout, heartbeatTimeout * 1000);
+        }
+    }
+
+    function onHeartbeatTimeout() {
+        log.warn(LOG_ID, `Job ${jobId} run ${runId}: no heartbeat in ${heartbeatTimeout} seconds (processed ${progress.processed}), stopping`);
+        runOptions.stop().catch(
+            e => log.error(LOG_ID, e)
+        );
+    }
+
     async function onRunFailFromRunningStatus(errMsg) {
         await cleanBuffer();
         clearTimeout(accessTokenRefreshTimer);
+        clearTimeout(heartbeatTimer);
         await runOptions.onRunFail(jobId, runId, runData, errMsg);
     }
 
@@ -229,6 +391,7 @@ function createRunManager(jobId, runId, runOptions) {
     async function onRunSuccess(config) {
         await cleanBuffer();
         clearTimeout(accessTokenRefreshTimer);
+        clearTimeout(heartbeatTimer);
 
         runOptions.onRunSuccess();
         runData.finished_at = new Date();
@@ -300,7 +463,7 @@ function createRunManager(jobId, runId, runOptions) {
                 }
                 break;
             case 'request':
-                return await handleRequest(jobId, data);
+                return await handleRequest(jobId, data, onProgress);
             default:
                 log.info(LOG_ID, `Job ${jobId} run ${runId}: unknown event ${type} `);
                 break;
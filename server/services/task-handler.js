@@ -9,7 +9,7 @@ const {TaskType, BuildState, isTransitionState} = require('../../shared/tasks');
 const log = require('../lib/log');
 const moment = require('moment');
 const getTaskBuildOutputDir = require('../lib/task-handler').getTaskBuildOutputDir;
-const {resolveAbs, getFieldsetPrefix} = require('../../shared/param-types-helpers');
+const {resolveAbs, getFieldsetPrefix, parseCardinality} = require('../../shared/param-types-helpers');
 const {getSignalEntitySpec} = require('../lib/signal-helpers')
 const {getSignalSetEntitySpec} = require('../lib/signal-set-helpers')
 const {createRunManager} = require('./jobs/run-manager');
@@ -177,16 +177,18 @@ async function afterDelay(msg, task, job) {
 
 /**
  * Prepare entities specifications for a job, like index name in es.
+ * Loads entities referenced by job params and owned by the job. Other entities are requested by the job on demand.
  * @param job
  * @param jobParams Stored job parameters
  * @param taskParams Set task parameters
- * @returns {Promise<void>}
+ * @returns {Promise<{entities: Object, completeSignalSets: string[]}>} Entities and cids of signal sets with all their signals included
  */
 async function getEntitiesFromParams(job, jobParams, taskParams) {
     const entities = {
         signalSets: {},
         signals: {}
     };
+    const completeSignalSets = new Set();
 
     function getJobParamByRef(prefix = '/', ref) {
         const abs = ref ? resolveAbs(prefix, ref) : prefix;
@@ -227,6 +229,7 @@ async function getEntitiesFromParams(job, jobParams, taskParams) {
         }
 
         entities.signals[signalSet.cid] = specSignals;
+        completeSignalSets.add(signalSet.cid);
     }
 
 
@@ -248,6 +251,9 @@ async function getEntitiesFromParams(job, jobParams, taskParams) {
                     const signalSetCid = jobParamsSpec[param.id];
 
                     if (!signalSetCid) {
+                        if (parseCardinality(param.cardinality).min === 0) {
+                            continue;
+                        }
                         throw new Error(`Job doesn't specify parameter ${param.id}.`);
                     }
 
@@ -274,17 +280,20 @@ async function getEntitiesFromParams(job, jobParams, taskParams) {
 
                 case 'signal': {
 
-                    const signalSetCid = param.signalSetRef ? getJobParamByRef(prefix, param.signalSetRef) : param.signalSet;
-                    if (!signalSetCid) {
-                        throw new Error(`Signal set's cid for parameter ${param.id} not specified.`);
-                    }
-
                     let signalCids = jobParamsSpec[param.id];
 
-                    if (!signalCids) {
+                    if (!signalCids || (Array.isArray(signalCids) && signalCids.length === 0)) {
+                        if (parseCardinality(param.cardinality).min === 0) {
+                            continue;
+                        }
                         throw new Error(`Signal's cid for parameter ${param.id} not specified.`);
                     }
 
+                    const signalSetCid = param.signalSetRef ? getJobParamByRef(prefix, param.signalSetRef) : param.signalSet;
+                    if (!signalSetCid) {
+                        throw new Error(`Signal set's cid for parameter ${param.id} not specified.`);
+                    }
+
                     // Single select
                     if (!Array.isArray(signalCids)) {
                         signalCids = [signalCids];
@@ -322,6 +331,11 @@ async function getEntitiesFromParams(job, jobParams, taskParams) {
 
                         let jobParamSpec = jobParamsSpec[param.id];
 
+                        if (jobParamSpec == null) {
+                            // Optional fieldset not filled in
+                            continue;
+                        }
+
                         if (!Array.isArray(jobParamSpec)) {
                             jobParamSpec = [jobParamSpec];
                         }
@@ -352,7 +366,10 @@ async function getEntitiesFromParams(job, jobParams, taskParams) {
         await addAllSignalsOfSignalSet(signalSet);
     }
 
-    return entities;
+    return {
+        entities,
+        completeSignalSets: [...completeSignalSets]
+    };
 }
 
 async function getSignalSetsOwnedByJob(jobId) {
@@ -401,7 +418,9 @@ async function processRunMsg(msg, task, job) {
     const spec = msg.spec;
     try {
         spec.params = JSON.parse(job.params);
-        spec.entities = await getEntitiesFromParams(job, spec.params, JSON.parse(task.settings).params);
+        const {entities, completeSignalSets} = await getEntitiesFromParams(job, spec.params, JSON.parse(task.settings).params);
+        spec.entities = entities;
+        spec.completeSignalSets = completeSignalSets;
         spec.owned = await getOwnedEntities(job);
     } catch (error) {
         return void await onRunFail(job.id, spec.runId, null, error.message);
@@ -861,6 +880,7 @@ async function handleRun(workEntry) {
                 },
                 params: spec.params || {},
                 entities: spec.entities,
+                completeSignalSets: spec.completeSignalSets,
                 owned: spec.owned,
                 accessToken: await requestJobRestrictedAccessToken(jobId, runId),
                 es: {
@@ -885,6 +905,7 @@ async function handleRun(workEntry) {
                 inProcessMsgs.delete(runId);
                 jobRunning.delete(jobId);
             },
+            stop: () => handler.stop(runId),
             emit: emitToCoreSystem
         });
 
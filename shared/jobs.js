@@ -34,7 +34,11 @@ Object.freeze(HandlerMsgType)
 
 const JobMsgType = {
     STORE_STATE: 'store_state',
-    CREATE_SIGNALS: 'create_signals'
+    CREATE_SIGNALS: 'create_signals',
+    GET_ENTITIES: 'get_entities',
+    REMOVE_RECORDS: 'remove_records',
+    PROGRESS: 'progress',
+    CANCEL: 'cancel'
 };
 
 Object.freeze(JobMsgType)
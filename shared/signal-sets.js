@@ -10,6 +10,13 @@ const SignalSetKind = {
     TIME_SERIES: 'time_series'
 };
 
+// Time periods of the indices a signal set can be partitioned into
+const SignalSetPartitioning = {
+    YEAR: 'year',
+    MONTH: 'month',
+    DAY: 'day'
+};
+
 // This value tells server it needs to choose ts signal
 const SUBSTITUTE_TS_SIGNAL = '__substitute_ts_signal__';
 const DEFAULT_TS_SIGNAL_CID = 'ts';
@@ -20,6 +27,7 @@ const DEFAULT_MIN_SUBAGGS_BUCKETS = 10;
 module.exports = {
     SignalSetType,
     SignalSetKind,
+    SignalSetPartitioning,
     SUBSTITUTE_TS_SIGNAL,
     DEFAULT_TS_SIGNAL_CID,
     DEFAULT_MIN_SUBAGGS_BUCKETS
@@ -65,6 +65,8 @@ const WizardType = {
 const BuiltinTaskNames = {
     AGGREGATION: "aggregation",
     FLATTEN: "flatten",
+    RETENTION: "retention",
+    DOWNSAMPLING: "downsampling",
 }
 
 const Permission = {